@@ -1,23 +1,55 @@
 import sys
-import os
 import contextlib
 import re
-import array
-from transformers import pipeline
-from llama_cpp import Llama
+from collections import OrderedDict
+from generator.prompt_cache import PromptCache, _common_prefix
+from generator.llama_config import LlamaConfig, auto_tune_threads
+from generator.t5_backend import load_t5_pipeline, BACKENDS as T5_BACKENDS
+import time
+import threading
+import numpy as np
+
+class _ThreadFilteredStream:
+    """Wraps sys.stdout/sys.stderr and drops writes made by silenced threads only."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        if threading.get_ident() in _silenced_threads:
+            return len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+_silenced_threads = set()
+_streams_lock = threading.Lock()
+
+
+def install_stream_filter():
+    # Wraps the global streams once; call it on the main thread before starting loader threads
+    with _streams_lock:
+        if not isinstance(sys.stdout, _ThreadFilteredStream):
+            sys.stdout = _ThreadFilteredStream(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadFilteredStream):
+            sys.stderr = _ThreadFilteredStream(sys.stderr)
+
 
 @contextlib.contextmanager
 def suppress_stdout_stderr():
-    with open(os.devnull, "w") as devnull:
-        old_stdout = sys.stdout
-        old_stderr = sys.stderr
-        sys.stdout = devnull
-        sys.stderr = devnull
-        try:
-            yield
-        finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
+    # Silences the current thread only: a model loading on the warm-up thread must not
+    # swallow the prompt or results the main thread prints meanwhile
+    install_stream_filter()
+    ident = threading.get_ident()
+    nested = ident in _silenced_threads
+    _silenced_threads.add(ident)
+    try:
+        yield
+    finally:
+        if not nested:
+            _silenced_threads.discard(ident)
 
 
 def parse_mcq_input(user_input):
@@ -36,90 +68,443 @@ def parse_mcq_input(user_input):
             "D": d.strip().capitalize()
         }
 
+# Which model each task needs, so only that one is loaded
+TASK_MODELS = {"summarize": "t5", "qa": "llm", "mcq": "llm"}
+# Prompt size in llama tokens (BOS, instruction, context and question together)
+PROMPT_TOKEN_BUDGET = {"qa": 512, "mcq": 1024}
+CONTEXT_SEPARATOR = "\n\n"
+TOKEN_CACHE_SIZE = 4096
+# RAM for saved llama.cpp KV states (prefix reuse across prompts); 0 disables it
+PROMPT_CACHE_BYTES = 1 << 30
+QA_HEAD = (
+    "### Instruction:\n"
+    "Given the following context, answer the question.\n\n"
+    "### Context:\n"
+)
+# llama.cpp completion settings per task
+LLM_SETTINGS = {
+    "qa": {"max_tokens": 100, "stop": ["\n", "</s>"]},
+    "mcq": {"max_tokens": 16},
+}
+# flan-t5 input limit and summary lengths for the map (per chunk group) and final stages
+T5_INPUT_TOKENS = 512
+SUMMARY_MAP_MAX_LENGTH = 128
+SUMMARY_MAX_LENGTH = 256
+SUMMARY_MODES = ("map_reduce", "single")
+MCQ_LETTERS = ("A", "B", "C", "D")
+# "logits" reads the answer off one forward pass; "free" lets llama.cpp generate text and parses it
+MCQ_MODES = ("logits", "free")
+MCQ_HEAD = (
+    "You are a helpful assistant. Use the context to choose the correct option (A, B, C, or D).\n\n"
+    "Context:\n"
+)
+
 class Generator:
-    def __init__(self):
-        # flan-t5 for summarization
-        self.t5_pipeline = pipeline("text2text-generation", model="google/flan-t5-large", device=-1)
+    def __init__(self, prompt_cache_bytes=PROMPT_CACHE_BYTES, summary_mode="map_reduce", summary_batch_size=8,
+                 t5_backend="fp32", llama_config=None, mcq_mode="logits"):
+        if mcq_mode not in MCQ_MODES:
+            raise ValueError(f"Unsupported mcq mode: {mcq_mode}. Choose from {MCQ_MODES}")
+        if t5_backend not in T5_BACKENDS:
+            raise ValueError(f"Unsupported t5 backend: {t5_backend}. Choose from {T5_BACKENDS}")
+        if summary_mode not in SUMMARY_MODES:
+            raise ValueError(f"Unsupported summary mode: {summary_mode}. Choose from {SUMMARY_MODES}")
+        # Models are loaded on first use (or by warm_up), not at construction time
+        self._models = {}
+        self.t5_backend = t5_backend
+        # llama.cpp runtime settings (file + LLAMA_* env overrides unless given explicitly)
+        self.llama_config = llama_config or LlamaConfig.load()
+        self.thread_tuning = None
+        self.summary_mode = summary_mode
+        self.mcq_mode = mcq_mode
+        self.summary_batch_size = summary_batch_size
+        # Per-stage wall time and token counts of the last summary
+        self.last_summary_stats = []
+        self.prompt_cache_bytes = prompt_cache_bytes
+        self.prompt_cache = None
+        self._locks = {"t5": threading.Lock(), "llm": threading.Lock()}
+        self.load_times = {}
+        # TTFT and throughput of the last llama.cpp completion
+        self.last_generation = None
+        # (text, add_bos) -> llama token ids, so retrieved chunks are tokenized once
+        self._token_cache = OrderedDict()
+        self._token_lock = threading.Lock()
+
+    def _load_t5(self):
+        # flan-t5 for summarization; transformers is only imported when a summary is needed
+        return load_t5_pipeline(self.t5_backend)
+
+    def _load_llm(self):
         # llama.cpp for QA and MCQs
+        from llama_cpp import Llama
+        with suppress_stdout_stderr():
+            llm = Llama(**self.llama_config.llama_kwargs())
+        if self.llama_config.auto_tune:
+            print("Tuning llama.cpp thread counts...")
+            self.thread_tuning = auto_tune_threads(llm)
+            print(f"Using n_threads={self.thread_tuning['n_threads']}, "
+                  f"n_threads_batch={self.thread_tuning['n_threads_batch']}")
+        if self.prompt_cache_bytes:
+            self.prompt_cache = PromptCache(self.prompt_cache_bytes)
+            llm.set_cache(self.prompt_cache)
+            self._prime_prompt_cache(llm)
+        return llm
+
+    def _prime_prompt_cache(self, llm):
+        # Evaluate the fixed instruction headers once so every qa/mcq prompt starts from a cached state
+        bos = llm.tokenize(b"", add_bos=True)
         with suppress_stdout_stderr():
-            self.llm = Llama(model_path="D:/Softwares/LLAMA/TheBloke/CapybaraHermes-2.5-Mistral-7B-GGUF/capybarahermes-2.5-mistral-7b.Q4_K_S.gguf",n_ctx=2048, n_threads=4)
+            for head in (QA_HEAD, MCQ_HEAD):
+                tokens = bos + llm.tokenize(head.encode("utf-8"), add_bos=False)
+                llm.reset()
+                llm.eval(tokens)
+                self.prompt_cache[tokens] = llm.save_state()
+                self.prompt_cache.min_prefix = max(self.prompt_cache.min_prefix, len(tokens))
 
-    
+    def prompt_cache_stats(self):
+        return self.prompt_cache.stats() if self.prompt_cache is not None else None
+
+    def _get_model(self, name):
+        if name not in self._models:
+            with self._locks[name]:
+                if name not in self._models:
+                    start = time.perf_counter()
+                    self._models[name] = self._load_t5() if name == "t5" else self._load_llm()
+                    self.load_times[name] = time.perf_counter() - start
+                    print(f"Loaded {name} model in {self.load_times[name]:.1f}s")
+        return self._models[name]
+
+    @property
+    def t5_pipeline(self):
+        return self._get_model("t5")
+
+    @property
+    def llm(self):
+        return self._get_model("llm")
+
+    def warm_up(self, task_types):
+        """Loads the models needed for the given task types on a background thread."""
+        names = sorted({TASK_MODELS[task] for task in task_types if task in TASK_MODELS})
+        # The loaders silence themselves; wrap the streams here so the thread never swaps them
+        install_stream_filter()
+
+        def load():
+            for name in names:
+                self._get_model(name)
+
+        thread = threading.Thread(target=load, name="generator-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+    def tokenize(self, text, add_bos=False):
+        """Llama token ids of text, served from an LRU cache when seen before."""
+        key = (text, add_bos)
+        with self._token_lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                return tokens
+        tokens = self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos)
+        self._cache_tokens(key, tokens)
+        return tokens
+
+    def _cache_tokens(self, key, tokens):
+        with self._token_lock:
+            self._token_cache[key] = tokens
+            self._token_cache.move_to_end(key)
+            while len(self._token_cache) > TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+
+    def tokenize_continuation(self, text):
+        """
+        Token ids of text as it appears mid-prompt right after a newline. llama.cpp's SPM
+        tokenizer adds a leading space to every tokenize() call, so text is tokenized
+        behind a newline and the newline's own tokens are dropped; SPM never merges
+        across a newline, so the ids match tokenizing the whole prompt at once.
+        """
+        newline = self.tokenize("\n")
+        tokens = self.tokenize("\n" + text)
+        if list(tokens[:len(newline)]) == list(newline):
+            return tokens[len(newline):]
+        return self.tokenize(text)
+
+    def pack_context(self, context_chunks, budget):
+        """
+        Keeps chunks in rank order while they fit in budget tokens; a chunk that does
+        not fit is skipped so a shorter, lower-ranked one can still use the space.
+        Returns the kept chunks and their concatenated token ids.
+        """
+        # Every chunk follows a newline (the end of the head or the separator)
+        separator = self.tokenize_continuation(CONTEXT_SEPARATOR)
+        kept, tokens = [], []
+        for chunk in context_chunks:
+            chunk_tokens = self.tokenize_continuation(chunk)
+            needed = len(chunk_tokens) + (len(separator) if kept else 0)
+            if len(tokens) + needed > budget:
+                continue
+            if kept:
+                tokens.extend(separator)
+            tokens.extend(chunk_tokens)
+            kept.append(chunk)
+        return kept, tokens
+
+    def _pack_prompt(self, head, context_chunks, tail, task_type):
+        # Instruction and question are always kept whole; the context gets what is left.
+        # The head comes first so its KV state is shared through the prompt cache. Heads end
+        # with a newline and tails start with one, so every later segment is a continuation.
+        bos = self.tokenize("", add_bos=True)
+        head_tokens, tail_tokens = self.tokenize(head), self.tokenize_continuation(tail)
+        budget = PROMPT_TOKEN_BUDGET[task_type] - len(bos) - len(head_tokens) - len(tail_tokens)
+        kept, context_tokens = self.pack_context(context_chunks, max(budget, 0))
+        prompt = head + CONTEXT_SEPARATOR.join(kept) + tail
+        # generate_answer looks the prompt up here instead of re-tokenizing it
+        self._cache_tokens((prompt, True), bos + head_tokens + context_tokens + tail_tokens)
+        return prompt
 
     def build_prompt(self, context_chunks, question, task_type):
-        context_text = " ".join(context_chunks)
         if task_type == "qa":
-             return (
-                f"### Instruction:\n"
-                f"Given the following context, answer the question.\n\n"
-                f"### Context:\n{context_text}\n\n"
-                f"### Question:\n{question}\n\n"
-                f"### Answer:\n"
+            return self._pack_prompt(
+                QA_HEAD,
+                context_chunks,
+                f"\n\n### Question:\n{question}\n\n"
+                f"### Answer:\n",
+                task_type,
             )
 
         elif task_type == "mcq":
             q_text, options = parse_mcq_input(question)
             options_text = "\n".join([f"{k}. {v}" for k, v in options.items()])
-            return (
-                f"You are a helpful assistant. Choose the correct option (A, B, C, or D).\n\n"
-                f"Question: {q_text}\n\nOptions:\n{options_text}"
+            return self._pack_prompt(
+                MCQ_HEAD,
+                context_chunks,
+                f"\n\nQuestion: {q_text}\n\nOptions:\n{options_text}\n\nAnswer:",
+                task_type,
             )
         elif task_type == "summarize":
-            return f"Summarize: {context_text}"
+            return f"Summarize: {' '.join(context_chunks)}"
         else:
-            return context_text
+            return " ".join(context_chunks)
 
-    def generate_answer(self, prompt, task_type):
+    def prompt_tokens(self, prompt, task_type):
+        """
+        Token ids for a qa/mcq prompt. Prompts from build_prompt already fit the budget;
+        any other prompt that is too long keeps its last tokens after BOS.
+        """
+        tokens = self.tokenize(prompt, add_bos=True)
+        budget = PROMPT_TOKEN_BUDGET[task_type]
+        if len(tokens) > budget:
+            bos = self.tokenize("", add_bos=True)
+            tokens = bos + tokens[len(tokens) - budget + len(bos):]
+        return tokens
+
+    @staticmethod
+    def _check_prompt(prompt):
         # Checking if prompt is string or empty
         if not isinstance(prompt, str):
             raise TypeError(f"Prompt must be a string, got {type(prompt)}")
         if not prompt.strip():
             raise ValueError("Prompt is empty.")
 
-        if task_type == "summarize":
-            result = self.t5_pipeline(prompt, max_length=256, truncation=True)
-            return result[0].get('generated_text') or result[0].get('summary_text') or str(result[0])
+    def stream_answer(self, prompt, task_type):
+        """
+        Yields the qa/mcq answer text piece by piece as llama.cpp decodes it. Time to
+        first token and decode tokens/sec are stored in last_generation afterwards.
+        """
+        self._check_prompt(prompt)
+        if task_type not in LLM_SETTINGS:
+            raise ValueError(f"Streaming is only supported for {sorted(LLM_SETTINGS)}, got {task_type}")
 
-        elif task_type == "qa":
-            # Tokenize prompt
-            prompt_tokens_list = self.llm.tokenize(prompt.encode("utf-8"))
-            prompt_tokens = array.array('i', prompt_tokens_list)
+        prompt_tokens = self.prompt_tokens(prompt, task_type)
+        start = time.perf_counter()
+        # llama.cpp logs to stdout/stderr; only silence it while it runs, not while the caller prints
+        with suppress_stdout_stderr():
+            stream = self.llm(prompt_tokens, stream=True, **LLM_SETTINGS[task_type])
+        ttft = None
+        num_tokens = 0
+        while True:
+            with suppress_stdout_stderr():
+                chunk = next(stream, None)
+            if chunk is None:
+                break
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            num_tokens += 1
+            yield chunk["choices"][0]["text"]
 
-            # Truncate if too long
-            max_context = 512
-            if len(prompt_tokens) > max_context:
-                prompt_tokens = prompt_tokens_list[-max_context:]
-                prompt = self.llm.detokenize(prompt_tokens).decode("utf-8") 
+        total = time.perf_counter() - start
+        decode_time = total - (ttft or 0.0)
+        self.last_generation = {
+            "prompt_tokens": len(prompt_tokens),
+            "completion_tokens": num_tokens,
+            "ttft": ttft,
+            "total_seconds": total,
+            # The first token includes prompt evaluation, so it is left out of the decode rate
+            "tokens_per_sec": (num_tokens - 1) / decode_time if num_tokens > 1 and decode_time > 0 else 0.0,
+        }
 
-            with suppress_stdout_stderr():
-                output = self.llm(prompt, max_tokens=100, stop=["\n", "</s>"])
+    @staticmethod
+    def parse_mcq_answer(raw_output):
+        raw_output = raw_output.strip()
+        for letter in ['A', 'B', 'C', 'D']:
+            if raw_output.upper().startswith(letter):
+                return letter
+        return raw_output
 
-            return output['choices'][0]['text'].strip()
+    def _option_token_ids(self):
+        # A letter may be tokenized with or without a leading space after "Answer:"; both count
+        return {letter: sorted({self.tokenize(letter)[-1], self.tokenize(" " + letter)[-1]})
+                for letter in MCQ_LETTERS}
 
+    def _context_prefix_length(self, prompt, prompt_tokens):
+        # Tokens before the question: the instruction and retrieved context a later mcq may share
+        cut = prompt.rfind("\n\nQuestion:")
+        if cut <= 0:
+            return 0
+        return _common_prefix(self.tokenize(prompt[:cut], add_bos=True), prompt_tokens)
 
-        elif task_type == "mcq":
-            prompt_tokens_list = self.llm.tokenize(prompt.encode("utf-8"))
-            prompt_tokens = array.array('i', prompt_tokens_list)
+    def _eval_prompt(self, prompt_tokens, reusable=0):
+        # Start from the cached state sharing the longest prefix and only evaluate the rest.
+        # Only the first `reusable` tokens are saved back, and only if they are not cached yet,
+        # so states specific to one question do not fill the cache.
+        llm = self.llm
+        if self.prompt_cache is not None:
+            try:
+                llm.load_state(self.prompt_cache[prompt_tokens])
+            except KeyError:
+                pass
+        evaluated = llm.input_ids[:llm.n_tokens].tolist()
+        n_past = 0
+        while n_past < min(len(evaluated), len(prompt_tokens) - 1) and evaluated[n_past] == prompt_tokens[n_past]:
+            n_past += 1
+        llm.n_tokens = n_past
+        reusable = min(reusable, len(prompt_tokens) - 1)
+        if self.prompt_cache is not None and reusable > max(n_past, self.prompt_cache.min_prefix):
+            llm.eval(prompt_tokens[n_past:reusable])
+            self.prompt_cache[prompt_tokens[:reusable]] = llm.save_state()
+        llm.eval(prompt_tokens[llm.n_tokens:])
+        return len(prompt_tokens) - n_past
 
-            if len(prompt_tokens) > 1024:
-                prompt_tokens = prompt_tokens_list[-1024:]
-                prompt = self.llm.detokenize(prompt_tokens).decode("utf-8")
+    def _last_logits(self):
+        # Next-token logits after the last evaluated token
+        import llama_cpp
+        return np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.llm.ctx, -1), shape=(self.llm.n_vocab(),))
 
-            with suppress_stdout_stderr():
-                output = self.llm(prompt)
+    def answer_mcq(self, prompt):
+        """
+        Answers an mcq prompt with a single forward pass: the next-token logits are
+        compared over the four option letters. Returns the letter and the per-option
+        probabilities (softmax over the option tokens only).
+        """
+        self._check_prompt(prompt)
+        prompt_tokens = self.prompt_tokens(prompt, "mcq")
+        option_ids = self._option_token_ids()
+
+        start = time.perf_counter()
+        reusable = self._context_prefix_length(prompt, prompt_tokens) if self.prompt_cache is not None else 0
+        with suppress_stdout_stderr():
+            evaluated = self._eval_prompt(prompt_tokens, reusable)
+        logits = self._last_logits()
+        elapsed = time.perf_counter() - start
 
-            raw_output = output['choices'][0]['text'].strip()
+        ids = [token for letter in MCQ_LETTERS for token in option_ids[letter]]
+        weights = np.exp(logits[ids] - logits[ids].max())
+        weights /= weights.sum()
+        probabilities, i = {}, 0
+        for letter in MCQ_LETTERS:
+            probabilities[letter] = float(weights[i:i + len(option_ids[letter])].sum())
+            i += len(option_ids[letter])
 
-            for letter in ['A', 'B', 'C', 'D']:
-                if raw_output.upper().startswith(letter):
-                    return letter
-            return raw_output
+        self.last_generation = {
+            "prompt_tokens": len(prompt_tokens),
+            "evaluated_tokens": evaluated,
+            "completion_tokens": 1,
+            "ttft": elapsed,
+            "total_seconds": elapsed,
+            "tokens_per_sec": 0.0,
+        }
+        return max(probabilities, key=probabilities.get), probabilities
+
+    def generate_answer(self, prompt, task_type):
+        self._check_prompt(prompt)
+
+        if task_type == "summarize":
+            result = self.t5_pipeline(prompt, max_length=SUMMARY_MAX_LENGTH, truncation=True)
+            return self._generated_text(result[0])
+
+        elif task_type == "qa":
+            return "".join(self.stream_answer(prompt, task_type)).strip()
+
+        elif task_type == "mcq":
+            if self.mcq_mode == "logits":
+                return self.answer_mcq(prompt)[0]
+            return self.parse_mcq_answer("".join(self.stream_answer(prompt, task_type)))
 
         else:
             raise ValueError(f"Unsupported task_type: {task_type}")
 
 
 
+    @staticmethod
+    def _generated_text(result):
+        return result.get('generated_text') or result.get('summary_text') or str(result)
+
+    def _t5_token_counts(self, texts):
+        encoded = self.t5_pipeline.tokenizer(texts, add_special_tokens=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+
+    def _group_for_t5(self, texts, budget):
+        # Consecutive texts are merged while they fit the t5 input; an oversized text gets its own group
+        groups, current, current_tokens = [], [], 0
+        for text, num_tokens in zip(texts, self._t5_token_counts(texts)):
+            if current and current_tokens + num_tokens > budget:
+                groups.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += num_tokens
+        if current:
+            groups.append(" ".join(current))
+        return groups
+
+    def _summarize_batch(self, texts, max_length, stage):
+        prompts = [f"Summarize: {text}" for text in texts]
+        start = time.perf_counter()
+        results = self.t5_pipeline(prompts, batch_size=self.summary_batch_size, max_length=max_length, truncation=True)
+        elapsed = time.perf_counter() - start
+        summaries = [self._generated_text(result) for result in results]
+
+        stats = {
+            "stage": stage,
+            "inputs": len(prompts),
+            "input_tokens": sum(min(n, T5_INPUT_TOKENS) for n in self._t5_token_counts(prompts)),
+            "output_tokens": sum(self._t5_token_counts(summaries)),
+            "seconds": elapsed,
+        }
+        self.last_summary_stats.append(stats)
+        print(f"  {stage}: {stats['inputs']} input(s), {stats['input_tokens']} -> {stats['output_tokens']} tokens "
+              f"in {elapsed:.1f}s")
+        return summaries
+
+    def summarize_map_reduce(self, context_chunks):
+        """
+        Summarizes chunk groups that fit the flan-t5 input in batched pipeline calls (map),
+        then summarizes the partial summaries the same way until one input remains (reduce).
+        """
+        self.last_summary_stats = []
+        texts, stage = [chunk for chunk in context_chunks if chunk.strip()], "map"
+        if not texts:
+            return ""
+        budget = T5_INPUT_TOKENS - self._t5_token_counts(["Summarize: "])[0]
+        while True:
+            groups = self._group_for_t5(texts, budget)
+            if not groups:
+                return ""
+            if len(groups) == 1:
+                return self._summarize_batch(groups, SUMMARY_MAX_LENGTH, stage if stage == "map" else "final")[0]
+            texts = self._summarize_batch(groups, SUMMARY_MAP_MAX_LENGTH, stage)
+            stage = "reduce"
+
     def summarize_chunks(self, context_chunks, question):
+        if self.summary_mode == "map_reduce":
+            return self.summarize_map_reduce(context_chunks)
         prompt = self.build_prompt(context_chunks,question, task_type="summarize")
-        return self.generate_answer(prompt, task_type="summarize")
\ No newline at end of file
+        return self.generate_answer(prompt, task_type="summarize")
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import typing
+from dataclasses import dataclass, fields, asdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_FILE = os.path.join(BASE_DIR, "llama_config.json")
+ENV_PREFIX = "LLAMA_"
+
+
+@dataclass
+class LlamaConfig:
+    """
+    llama.cpp runtime settings. Values come from the defaults below, then the JSON file
+    at $LLAMA_CONFIG (or baseline/llama_config.json), then LLAMA_<FIELD> environment
+    variables, e.g. LLAMA_N_THREADS=16 or LLAMA_USE_MLOCK=true.
+    """
+    model_path: str = "D:/Softwares/LLAMA/TheBloke/CapybaraHermes-2.5-Mistral-7B-GGUF/capybarahermes-2.5-mistral-7b.Q4_K_S.gguf"
+    n_ctx: int = 2048
+    # Threads for decoding and for prompt evaluation; None lets llama.cpp pick
+    n_threads: typing.Optional[int] = 4
+    n_threads_batch: typing.Optional[int] = None
+    # Prompt tokens evaluated per llama_decode call
+    n_batch: int = 512
+    use_mmap: bool = True
+    use_mlock: bool = False
+    # Measure tokens/sec at startup and keep the fastest thread counts
+    auto_tune: bool = False
+
+    @classmethod
+    def load(cls, path=None, environ=None):
+        path = path or os.environ.get("LLAMA_CONFIG", CONFIG_FILE)
+        environ = os.environ if environ is None else environ
+        values = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                values.update(json.load(f))
+        for field in fields(cls):
+            env_value = environ.get(ENV_PREFIX + field.name.upper())
+            if env_value is not None:
+                values[field.name] = _parse(env_value, field.type)
+        unknown = set(values) - {field.name for field in fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown llama config keys: {sorted(unknown)}")
+        return cls(**values)
+
+    def llama_kwargs(self):
+        kwargs = asdict(self)
+        kwargs.pop("auto_tune")
+        return kwargs
+
+
+def _parse(value, field_type):
+    # Optional[int] -> int, with "none"/"" meaning None
+    args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+    if args:
+        if value.strip().lower() in ("", "none", "auto"):
+            return None
+        field_type = args[0]
+    if field_type is bool:
+        if value.strip().lower() not in ("1", "true", "yes", "0", "false", "no"):
+            raise ValueError(f"Expected a boolean, got {value!r}")
+        return value.strip().lower() in ("1", "true", "yes")
+    return field_type(value)
+
+
+def thread_candidates(max_threads=None):
+    max_threads = max_threads or os.cpu_count() or 1
+    candidates = {max_threads, max(max_threads // 2, 1)}
+    n = 1
+    while n < max_threads:
+        candidates.add(n)
+        n *= 2
+    return sorted(candidates)
+
+
+def set_threads(llm, n_threads, n_threads_batch):
+    import llama_cpp
+    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, n_threads_batch)
+    llm.n_threads, llm.n_threads_batch = n_threads, n_threads_batch
+
+
+def auto_tune_threads(llm, candidates=None, prompt_tokens=256, decode_tokens=16):
+    """
+    Times prompt evaluation (one batch of prompt_tokens) and single-token decoding for
+    each thread count, then sets n_threads_batch to the fastest prompt-eval count and
+    n_threads to the fastest decode count. Returns the picks and the measurements.
+    """
+    candidates = candidates or thread_candidates()
+    probe = llm.tokenize(b" The quick brown fox jumps over the lazy dog." * 64, add_bos=True)
+    probe = probe[:min(prompt_tokens, llm.n_batch, llm.n_ctx() - decode_tokens)]
+    measurements = []
+    for n_threads in candidates:
+        set_threads(llm, n_threads, n_threads)
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(probe)
+        prompt_rate = len(probe) / max(time.perf_counter() - start, 1e-9)
+
+        start = time.perf_counter()
+        for token in probe[1:decode_tokens + 1]:
+            llm.eval([token])
+        decode_rate = decode_tokens / max(time.perf_counter() - start, 1e-9)
+        measurements.append({"threads": n_threads, "prompt_tokens_per_sec": prompt_rate,
+                             "decode_tokens_per_sec": decode_rate})
+        print(f"  {n_threads:>3} threads: prompt {prompt_rate:.1f} tok/s, decode {decode_rate:.1f} tok/s")
+
+    best_batch = max(measurements, key=lambda m: m["prompt_tokens_per_sec"])["threads"]
+    best_decode = max(measurements, key=lambda m: m["decode_tokens_per_sec"])["threads"]
+    set_threads(llm, best_decode, best_batch)
+    llm.reset()
+    return {"n_threads": best_decode, "n_threads_batch": best_batch, "measurements": measurements}
@@ -0,0 +1,81 @@
+import threading
+
+
+def _common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PromptCache:
+    """
+    Bounded cache of llama.cpp KV states keyed on token ids. Llama looks up the entry
+    sharing the longest prefix with a new prompt and only evaluates the remaining
+    tokens, so the instruction header and repeated contexts are not re-evaluated.
+    Wraps llama_cpp.LlamaRAMCache (LRU, evicts beyond capacity_bytes) and counts
+    prefix hits and the number of prompt tokens they cover. A lookup only counts as a
+    hit when the reused prefix is longer than min_prefix tokens, so reusing the primed
+    BOS + instruction header that every prompt shares is not reported as a hit.
+    """
+
+    def __init__(self, capacity_bytes=1 << 30):
+        from llama_cpp import LlamaRAMCache
+        self.capacity_bytes = capacity_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lookup_tokens = 0
+        self.reused_tokens = 0
+        self.min_prefix = 0
+        self._cache = LlamaRAMCache(capacity_bytes=capacity_bytes)
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        key = list(key)
+        with self._lock:
+            self.lookup_tokens += len(key)
+            try:
+                state = self._cache[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            reused = _common_prefix(state.input_ids.tolist(), key)
+            if reused > self.min_prefix:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.reused_tokens += reused
+            return state
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __setitem__(self, key, state):
+        with self._lock:
+            self._cache[key] = state
+
+    def __len__(self):
+        return len(self._cache.cache_state)
+
+    def __bool__(self):
+        # Llama checks `if self.cache:` before every lookup, even when the cache is empty
+        return True
+
+    @property
+    def cache_size(self):
+        return self._cache.cache_size
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "size_bytes": self.cache_size,
+            "capacity_bytes": self.capacity_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            # Share of looked-up prompt tokens whose KV state came from the cache
+            "token_reuse_rate": self.reused_tokens / self.lookup_tokens if self.lookup_tokens else 0.0,
+        }
@@ -0,0 +1,90 @@
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+
+T5_MODEL = "google/flan-t5-large"
+# Smaller flan-t5 checkpoints trade some quality for a large CPU speed-up
+T5_SMALLER_MODELS = {"base": "google/flan-t5-base", "small": "google/flan-t5-small"}
+BACKENDS = ("fp32", "int8", "onnx", "base", "small")
+ONNX_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "t5_onnx")
+
+
+def load_t5_pipeline(backend="fp32", model_name=T5_MODEL, onnx_dir=ONNX_DIR):
+    """
+    Loads the flan-t5 text2text pipeline on CPU with the given backend:
+    "fp32" (PyTorch), "int8" (PyTorch with dynamic int8 quantization of the Linear layers),
+    "onnx" (ONNX Runtime via optimum; exported once to onnx_dir and reused afterwards)
+    or "base"/"small" (the smaller fp32 flan-t5 checkpoints).
+    """
+    # Imported here because transformers pulls in torch
+    from transformers import pipeline
+    if backend == "fp32":
+        return pipeline("text2text-generation", model=model_name, device=-1)
+    if backend in T5_SMALLER_MODELS:
+        return pipeline("text2text-generation", model=T5_SMALLER_MODELS[backend], device=-1)
+    if backend == "int8":
+        import torch
+        from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return pipeline("text2text-generation", model=model, tokenizer=AutoTokenizer.from_pretrained(model_name), device=-1)
+    if backend == "onnx":
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        if os.path.exists(os.path.join(onnx_dir, "config.json")):
+            model = ORTModelForSeq2SeqLM.from_pretrained(onnx_dir)
+            tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        else:
+            model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model.save_pretrained(onnx_dir)
+            tokenizer.save_pretrained(onnx_dir)
+        return pipeline("text2text-generation", model=model, tokenizer=tokenizer)
+    raise ValueError(f"Unsupported t5 backend: {backend}. Choose from {BACKENDS}")
+
+
+def benchmark(texts, backend, reference="fp32", max_length=256, batch_size=8):
+    """
+    Summarizes texts with the reference and candidate backends and reports per-text
+    latency plus ROUGE and BERTScore of the candidate summaries against the reference ones.
+    """
+    import evaluate
+    prompts = [f"Summarize: {text}" for text in texts]
+    report = {}
+    summaries = {}
+    for name in (reference, backend):
+        start = time.perf_counter()
+        t5 = load_t5_pipeline(name)
+        report[f"{name}_load_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = t5(prompts, batch_size=batch_size, max_length=max_length, truncation=True)
+        elapsed = time.perf_counter() - start
+        summaries[name] = [result["generated_text"] for result in results]
+        report[f"{name}_seconds_per_text"] = elapsed / max(len(prompts), 1)
+        del t5
+
+    report["speedup"] = report[f"{reference}_seconds_per_text"] / max(report[f"{backend}_seconds_per_text"], 1e-9)
+    rouge = evaluate.load("rouge").compute(predictions=summaries[backend], references=summaries[reference])
+    report.update({f"{key}_vs_{reference}": float(value) for key, value in rouge.items()})
+    bertscore = evaluate.load("bertscore").compute(predictions=summaries[backend], references=summaries[reference], lang="en")
+    report[f"bertscore_f1_vs_{reference}"] = float(np.mean(bertscore["f1"]))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a flan-t5 backend against the fp32 pipeline.")
+    parser.add_argument("--backend", type=str, default="int8", choices=BACKENDS)
+    parser.add_argument("--index-dir", type=str, required=True, help="Saved retriever index to sample chunk texts from.")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.index_dir, "metadata.pkl"), "rb") as f:
+        texts = [text for text in pickle.load(f)["texts"] if text]
+    rng = np.random.default_rng(0)
+    sample = [texts[i] for i in rng.choice(len(texts), min(args.samples, len(texts)), replace=False)]
+    for key, value in benchmark(sample, args.backend, batch_size=args.batch_size).items():
+        print(f"{key}: {value}")
@@ -3,36 +3,203 @@ os.environ["TOKENIZERS_PARALLELISM"] = "false"
 import json
 from datetime import datetime
 from retriever.retriever import Retriever
-from generator.generator import Generator
-from retriever.utils import extract_text_from_pdf
+from generator.generator import Generator, parse_mcq_input
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from retriever.utils import extract_file_part, pdf_page_count, file_sha256, ExtractionError
+from retriever.extraction_cache import ExtractionCache
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 INDEX_DIR = os.path.join(BASE_DIR, "retriever_index")
 DATA_DIR = os.path.join(BASE_DIR, "data")
 LOG_PATH = os.path.join(BASE_DIR, "logs")
 LOG_FILE = os.path.join(LOG_PATH, "log.jsonl")
+QUERY_CACHE_FILE = os.path.join(INDEX_DIR, "query_cache.npz")
+MANIFEST_FILE = os.path.join(INDEX_DIR, "manifest.json")
+EXTRACTION_CACHE_DIR = os.path.join(BASE_DIR, "extraction_cache")
+SUPPORTED_EXTENSIONS = (".txt", ".pdf")
+PAGES_PER_TASK = 16
 
 def ensure_dirs():
     os.makedirs(INDEX_DIR, exist_ok=True)
     os.makedirs(LOG_PATH, exist_ok=True)
 
-def load_documents(folder_path):
-    documents = []
-    for filename in os.listdir(folder_path):
+def doc_id_for(filename):
+    return os.path.splitext(filename)[0].replace(" ", "_")
+
+def _extraction_tasks(file_path):
+    # Large PDFs are split into page ranges so several workers can share one book
+    if not file_path.endswith(".pdf"):
+        return [(file_path, None, None)]
+    try:
+        num_pages = pdf_page_count(file_path)
+    except Exception:
+        # Unreadable PDF: a single task, whose error is then reported by extract_file_part
+        return [(file_path, 0, None)]
+    return [(file_path, start, min(start + PAGES_PER_TASK, num_pages))
+            for start in range(0, num_pages, PAGES_PER_TASK)]
+
+def _file_pages(filename, parts):
+    # Streams (page_no, text) from successive extraction results of one file
+    seconds, num_pages = 0.0, 0
+    for pages, elapsed, error in parts:
+        if error:
+            raise ExtractionError(f"Error reading {filename}: {error}")
+        seconds += elapsed
+        num_pages += len(pages)
+        yield from pages
+    print(f"Extracted {filename} in {seconds:.2f}s ({num_pages} page(s))")
+
+def _skip_failed(filename, pages, failed):
+    # A failed file ends its page stream early instead of aborting the whole indexing run
+    try:
+        yield from pages
+    except ExtractionError as e:
+        print(e)
+        if failed is not None:
+            failed.add(filename)
+
+def iter_documents(folder_path, filenames=None, workers=None, max_pending_tasks=None, cache=None, failed=None):
+    """
+    Yields {"id", "pages"} documents in sorted filename order, where "pages" is a
+    generator of (page_no, text). Page ranges are extracted on a process pool, at most
+    max_pending_tasks ahead of the consumer, so only a few pages are held in memory.
+    Files already in the extraction cache are read from it without PyMuPDF. Files that
+    fail to extract are not cached and their names are added to the failed set.
+    Each document's pages must be consumed before the next document is requested.
+    """
+    files = [
+        filename for filename in sorted(os.listdir(folder_path))
+        if filename.endswith(SUPPORTED_EXTENSIONS) and (filenames is None or filename in filenames)
+    ]
+    workers = workers or os.cpu_count() or 1
+    max_pending_tasks = max_pending_tasks or 2 * workers
+    cached = set()
+    if cache is not None:
+        cached = {filename for filename in files if cache.contains(os.path.join(folder_path, filename))}
+
+    def document(filename, parts):
         file_path = os.path.join(folder_path, filename)
-        if filename.endswith(".txt"):
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read().strip()
-        elif filename.endswith(".pdf"):
-            text = extract_text_from_pdf(file_path)
-        else:
-            continue
-        if text.strip():
-            doc_id = os.path.splitext(filename)[0].replace(" ", "_")
-            documents.append({"id": doc_id, "text": text})
-    return documents
-
-def log_result(question, retrieved_chunks, prompt, answer, task_type="qa"):
+        if filename in cached:
+            print(f"Loaded {filename} from extraction cache")
+            return {"id": doc_id_for(filename), "pages": cache.read(file_path)}
+        pages = _file_pages(filename, parts)
+        if cache is not None:
+            pages = cache.store(file_path, pages)
+        return {"id": doc_id_for(filename), "pages": _skip_failed(filename, pages, failed)}
+
+    if workers == 1:
+        for filename in files:
+            tasks = [] if filename in cached else _extraction_tasks(os.path.join(folder_path, filename))
+            yield document(filename, (extract_file_part(*task) for task in tasks))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        tasks = (
+            (filename, task)
+            for filename in files if filename not in cached
+            for task in _extraction_tasks(os.path.join(folder_path, filename))
+        )
+        window = deque()
+
+        def fill():
+            while len(window) < max_pending_tasks:
+                item = next(tasks, None)
+                if item is None:
+                    return
+                filename, task = item
+                window.append((filename, pool.submit(extract_file_part, *task)))
+
+        def results_for(filename):
+            while window and window[0][0] == filename:
+                future = window.popleft()[1]
+                fill()
+                yield future.result()
+
+        fill()
+        for filename in files:
+            yield document(filename, results_for(filename))
+            # Discard whatever the consumer did not read of this file
+            for _ in results_for(filename):
+                pass
+
+def load_documents(folder_path, filenames=None, workers=None, cache=None, failed=None):
+    return [
+        {"id": doc["id"], "pages": list(doc["pages"])}
+        for doc in iter_documents(folder_path, filenames, workers, cache=cache, failed=failed)
+    ]
+
+def check_doc_ids(filenames):
+    """
+    Raises if two files map to the same doc_id (e.g. "notes.txt" and "notes.pdf", or
+    "a b.txt" and "a_b.txt"): updating or removing one would delete the other's chunks.
+    """
+    by_doc_id = {}
+    for filename in filenames:
+        by_doc_id.setdefault(doc_id_for(filename), []).append(filename)
+    clashes = [names for names in by_doc_id.values() if len(names) > 1]
+    if clashes:
+        raise ValueError("Files share a document id; rename them: "
+                         + "; ".join(" / ".join(names) for names in clashes))
+
+def scan_data_dir(folder_path, cache=None):
+    """Content hash of every supported file, keyed by filename."""
+    filenames = [filename for filename in sorted(os.listdir(folder_path)) if filename.endswith(SUPPORTED_EXTENSIONS)]
+    check_doc_ids(filenames)
+    digest = cache.digest if cache is not None else file_sha256
+    return {filename: digest(os.path.join(folder_path, filename)) for filename in filenames}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return None
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(manifest, failed=()):
+    # Files that failed to extract are left out so the next run retries them
+    manifest = {filename: digest for filename, digest in manifest.items() if filename not in failed}
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def sync_index(retriever, manifest, current, cache=None, failed=None):
+    """Re-indexes only new or changed files and drops removed ones. Returns True if anything changed."""
+    changed = [filename for filename, digest in current.items() if manifest.get(filename) != digest]
+    removed = [filename for filename in manifest if filename not in current]
+    if removed:
+        print(f"Removing {len(removed)} deleted file(s) from the index...")
+        retriever.delete_documents([doc_id_for(filename) for filename in removed])
+    if changed:
+        print(f"Indexing {len(changed)} new or changed file(s)...")
+        retriever.upsert_documents(load_documents(DATA_DIR, set(changed), cache=cache, failed=failed))
+    return bool(changed or removed)
+
+def retrieve_mcq_context(retriever, query_text, k=15):
+    """
+    Retrieves evidence for an MCQ: the question and each "question + option" are queried
+    in one batched hybrid call. Every option's best chunk comes first, so each option has
+    evidence in the prompt, followed by the remaining chunks ranked by reciprocal-rank
+    evidence summed over all queries (stored as "distance").
+    """
+    q_text, options = parse_mcq_input(query_text)
+    queries = [q_text] + [f"{q_text} {option}" for option in options.values()]
+    ranked = retriever.hybrid_query_batch(queries, k=k)
+
+    chunks, evidence = {}, {}
+    for results in ranked:
+        for rank, chunk in enumerate(results, 1):
+            chunks[chunk["chunk_id"]] = chunk
+            evidence[chunk["chunk_id"]] = evidence.get(chunk["chunk_id"], 0.0) + 1.0 / (retriever.rrf_k + rank)
+
+    order = []
+    for results in ranked[1:]:
+        best = next((chunk["chunk_id"] for chunk in results if chunk["chunk_id"] not in order), None)
+        if best is not None:
+            order.append(best)
+    order += sorted((chunk_id for chunk_id in evidence if chunk_id not in order),
+                    key=evidence.get, reverse=True)
+    return [dict(chunks[chunk_id], distance=evidence[chunk_id]) for chunk_id in order[:k]]
+
+def log_result(question, retrieved_chunks, prompt, answer, task_type="qa", timings=None):
     log_entry = {
         "timestamp": datetime.now().isoformat(),
         "task_type": task_type,
@@ -41,6 +208,8 @@ def log_result(question, retrieved_chunks, prompt, answer, task_type="qa"):
         "prompt": prompt,
         "generated_answer": answer
     }
+    if timings:
+        log_entry["timings"] = timings
     with open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write(json.dumps(log_entry) + "\n")
 
@@ -48,19 +217,34 @@ def main():
     ensure_dirs()
     retriever = Retriever()
     generator = Generator()
+    # Start loading the embedder now; generator models load once the task is known
+    retriever.warm_up()
 
     index_exists = os.path.exists(os.path.join(INDEX_DIR, "faiss.index"))
+    extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR)
+    current_files = scan_data_dir(DATA_DIR, extraction_cache)
+    failed_files = set()
 
     if index_exists:
         print("Loading existing FAISS index...")
         retriever.load(INDEX_DIR)
+        manifest = load_manifest()
+        if manifest is None:
+            # Index predates the manifest: assume it matches data/ and start tracking from here
+            save_manifest(current_files)
+        elif sync_index(retriever, manifest, current_files, extraction_cache, failed_files):
+            retriever.save(INDEX_DIR)
+            save_manifest(current_files, failed_files)
     else:
         print("Index not found. Indexing documents from data/ ...")
-        documents = load_documents(DATA_DIR)
-        retriever.add_documents(documents)
+        # Extraction runs ahead on a process pool while chunks are embedded
+        retriever.add_documents(iter_documents(DATA_DIR, cache=extraction_cache, failed=failed_files))
         retriever.save(INDEX_DIR)
+        save_manifest(current_files, failed_files)
 
-    known_doc_ids = set(cid.split("_chunk_")[0] for cid in retriever.chunk_ids)
+    retriever.load_query_cache(QUERY_CACHE_FILE)
+
+    known_doc_ids = set(doc["doc_id"] for doc in retriever.documents if doc is not None)
 
     def find_relevant_doc_id_in_prompt(prompt: str) -> str:
         for doc_id in known_doc_ids:
@@ -76,6 +260,8 @@ def main():
             if task_type == "exit": break
             if task_type not in {"qa", "summarize", "mcq"}:
                 print("Invalid. Choose qa, summarize, or mcq."); continue
+            # Load the task's model while the user types the prompt
+            generator.warm_up([task_type])
 
             query_text = input("Prompt: ").strip()
             if query_text.lower() == "exit": break
@@ -83,28 +269,64 @@ def main():
                 print("Empty prompt. Try again."); continue
 
             k = 20 if task_type == "summarize" else 15
-            retrieved = retriever.hybrid_query(query_text, k=k)[:10]
+            if task_type == "mcq":
+                try:
+                    # Option-aware evidence, packed into the mcq prompt by the generator
+                    retrieved = retrieve_mcq_context(retriever, query_text, k=k)[:10]
+                except ValueError as e:
+                    print(e); continue
+            else:
+                retrieved = retriever.hybrid_query(query_text, k=k)[:10]
             context_chunks = [chunk["text"] for chunk in retrieved]
 
             if not context_chunks:
                 print("No relevant chunks found."); continue
 
+            print("\nTop Retrieved Chunks:")
+            for chunk in retrieved:
+                print(f"- {chunk['chunk_id']} (Score: {chunk['distance']:.4f})\n  {chunk['text'][:200]}...\n")
+
+            timings = None
             if task_type == "summarize":
                 prompt = generator.build_prompt(context_chunks,question=query_text, task_type="summarize")
                 answer = generator.summarize_chunks(context_chunks,question=query_text)
+                print(f"\nGenerated Answer:\n{answer}\n")
+            elif task_type == "mcq" and generator.mcq_mode == "logits":
+                prompt = generator.build_prompt(context_chunks, question=query_text, task_type=task_type)
+                answer, probabilities = generator.answer_mcq(prompt)
+                timings = dict(generator.last_generation, option_probabilities=probabilities)
+                print(f"\nGenerated Answer:\n{answer}  "
+                      + "  ".join(f"{letter}: {p:.1%}" for letter, p in probabilities.items())
+                      + f"\n[{timings['total_seconds']:.2f}s, {timings['evaluated_tokens']} prompt tokens evaluated]\n")
             else:
                 prompt = generator.build_prompt(context_chunks, question=query_text, task_type=task_type)
-                answer = generator.generate_answer(prompt,task_type)
-
-            print("\nTop Retrieved Chunks:")
-            for chunk in retrieved:
-                print(f"- {chunk['chunk_id']} (Score: {chunk['distance']:.4f})\n  {chunk['text'][:200]}...\n")
-            print(f"\nGenerated Answer:\n{answer}\n")
+                # Print tokens as llama.cpp produces them
+                print("\nGenerated Answer:")
+                pieces = []
+                for piece in generator.stream_answer(prompt, task_type):
+                    pieces.append(piece)
+                    print(piece, end="", flush=True)
+                answer = "".join(pieces).strip()
+                if task_type == "mcq":
+                    answer = generator.parse_mcq_answer(answer)
+                    print(f"\nAnswer: {answer}", end="")
+                timings = generator.last_generation
+                ttft = timings["ttft"] or 0.0
+                print(f"\n[TTFT {ttft:.2f}s, {timings['tokens_per_sec']:.1f} tokens/sec, "
+                      f"{timings['completion_tokens']} tokens in {timings['total_seconds']:.2f}s]\n")
 
-            log_result(query_text, context_chunks, prompt, answer, task_type)
+            log_result(query_text, context_chunks, prompt, answer, task_type, timings)
 
         except (KeyboardInterrupt, EOFError):
             print("\nExiting gracefully."); break
 
+    # Keep query embeddings for the next session
+    retriever.save_query_cache(QUERY_CACHE_FILE)
+    prompt_cache = generator.prompt_cache_stats()
+    if prompt_cache:
+        print(f"Prompt cache: {prompt_cache['hits']} hits, {prompt_cache['misses']} misses, "
+              f"{prompt_cache['token_reuse_rate']:.0%} of prompt tokens reused "
+              f"({prompt_cache['size_bytes'] / 2**20:.0f}/{prompt_cache['capacity_bytes'] / 2**20:.0f} MiB)")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
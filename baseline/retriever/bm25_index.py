@@ -0,0 +1,336 @@
+import os
+import json
+import numpy as np
+from retriever.utils import save_npy_atomic
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an inverted index stored as CSR-style postings:
+    for term t, doc_ids[indptr[t]:indptr[t+1]] are the chunks containing it
+    and tfs[...] the matching term frequencies. Scores match rank_bm25.BM25Okapi.
+    """
+
+    ARRAYS = ("indptr", "doc_ids", "tfs", "doc_len", "alive", "idf", "max_score")
+
+    def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = {}
+        self.indptr = None
+        self.doc_ids = None
+        self.tfs = None
+        self.doc_len = None
+        self.alive = None
+        self.idf = None
+        self.max_score = None
+        self._doc_norm = None
+        self._weights = None
+        self._presence = None
+
+    @property
+    def num_docs(self):
+        return len(self.doc_len)
+
+    @property
+    def num_alive(self):
+        return int(np.count_nonzero(self.alive))
+
+    @classmethod
+    def build(cls, tokenized_corpus, **params):
+        index = cls(**params)
+        postings, doc_len = index._to_postings(tokenized_corpus)
+        index._set_postings(postings, doc_len, np.ones(len(doc_len), dtype=bool))
+        return index
+
+    def _to_postings(self, tokenized_corpus):
+        from scipy import sparse
+        # Extends the vocabulary and returns a (docs x terms) CSC matrix of term frequencies
+        rows, cols, lengths = [], [], []
+        for doc_idx, tokens in enumerate(tokenized_corpus):
+            lengths.append(len(tokens))
+            for token in tokens:
+                cols.append(self.vocab.setdefault(token, len(self.vocab)))
+            rows.extend([doc_idx] * len(tokens))
+
+        # Column-major (term -> docs) matrix; duplicates are summed into term frequencies
+        data = np.ones(len(rows), dtype=np.float32)
+        postings = sparse.csc_matrix(
+            (data, (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(lengths), len(self.vocab)),
+        )
+        return postings, np.asarray(lengths, dtype=np.float32)
+
+    def _postings_matrix(self):
+        from scipy import sparse
+        return sparse.csc_matrix(
+            (np.asarray(self.tfs), np.asarray(self.doc_ids), np.asarray(self.indptr)),
+            shape=(self.num_docs, len(self.vocab)),
+        )
+
+    def _set_postings(self, postings, doc_len, alive):
+        postings.sum_duplicates()
+        postings.sort_indices()
+        self.indptr = postings.indptr.astype(np.int64)
+        self.doc_ids = postings.indices.astype(np.int32)
+        self.tfs = postings.data.astype(np.float32)
+        self.doc_len = doc_len
+        self.alive = alive
+        self.idf = self._compute_idf()
+        self._prepare()
+        self.max_score = self._compute_max_score()
+        self._weights = None
+        self._presence = None
+
+    def append(self, tokenized_docs):
+        """Appends documents without re-tokenizing the existing ones; returns their doc ids."""
+        from scipy import sparse
+        start = self.num_docs
+        existing = self._postings_matrix()
+        new, new_len = self._to_postings(tokenized_docs)
+        existing.resize((start, len(self.vocab)))  # make room for newly seen terms
+        merged = sparse.vstack([existing, new], format="csc")
+        doc_len = np.concatenate([np.asarray(self.doc_len), new_len])
+        alive = np.concatenate([np.asarray(self.alive, dtype=bool), np.ones(len(new_len), dtype=bool)])
+        self._set_postings(merged, doc_len, alive)
+        return np.arange(start, self.num_docs)
+
+    def delete(self, doc_ids):
+        """Drops the postings of the given documents; their doc ids are never reused."""
+        from scipy import sparse
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        alive = np.array(self.alive, dtype=bool)
+        alive[doc_ids] = False
+        doc_len = np.array(self.doc_len, dtype=np.float32)
+        doc_len[doc_ids] = 0
+        postings = (sparse.diags(alive.astype(np.float32)) @ self._postings_matrix()).tocsc()
+        postings.eliminate_zeros()
+        self._set_postings(postings, doc_len, alive)
+
+    def _compute_idf(self):
+        # Same idf (with epsilon floor for very common terms) as rank_bm25.BM25Okapi
+        df = np.diff(self.indptr).astype(np.float64)
+        idf = np.log(self.num_alive - df + 0.5) - np.log(df + 0.5)
+        present = df > 0
+        if present.any():
+            idf[present & (idf < 0)] = self.epsilon * idf[present].mean()
+        return idf.astype(np.float32)
+
+    def _compute_max_score(self):
+        # Per-term upper bound on the BM25 contribution, used for MaxScore pruning
+        df = np.diff(self.indptr)
+        max_score = np.zeros(len(df), dtype=np.float32)
+        if not len(self.doc_ids):
+            return max_score
+        term_of_posting = np.repeat(np.arange(len(df)), df)
+        contrib = self._contrib(term_of_posting, np.asarray(self.doc_ids), np.asarray(self.tfs))
+        nonempty = df > 0
+        max_score[nonempty] = np.maximum.reduceat(contrib, self.indptr[:-1][nonempty])
+        return max_score
+
+    def _prepare(self):
+        avgdl = float(np.asarray(self.doc_len)[np.asarray(self.alive)].mean()) if self.num_alive else 0.0
+        if avgdl == 0.0:
+            avgdl = 1.0
+        self._doc_norm = (self.k1 * (1 - self.b + self.b * np.asarray(self.doc_len) / avgdl)).astype(np.float32)
+
+    def lookup(self, tokens):
+        """Map query tokens to (term_ids, query_term_counts); unknown tokens are dropped."""
+        counts = {}
+        for token in tokens:
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+        term_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        qtf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        return term_ids, qtf
+
+    def _contrib(self, term_id, docs, tf):
+        return self.idf[term_id] * tf * (self.k1 + 1) / (tf + self._doc_norm[docs])
+
+    def term_postings(self, term_id):
+        """Return (doc_ids, bm25 contributions) for a single term."""
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        docs = np.asarray(self.doc_ids[start:end])
+        tf = np.asarray(self.tfs[start:end])
+        return docs, self._contrib(term_id, docs, tf)
+
+    def _score_candidates(self, term_id, cand_docs):
+        # Look up only the given (sorted) candidates in the term's posting list
+        start, end = self.indptr[term_id], self.indptr[term_id + 1]
+        docs = self.doc_ids[start:end]
+        contrib = np.zeros(len(cand_docs), dtype=np.float32)
+        if not len(docs) or not len(cand_docs):
+            return contrib
+        pos = np.minimum(np.searchsorted(docs, cand_docs), len(docs) - 1)
+        hit = np.asarray(docs[pos]) == cand_docs
+        tf = np.asarray(self.tfs[start:end][pos[hit]])
+        contrib[hit] = self._contrib(term_id, cand_docs[hit], tf)
+        return contrib
+
+    @staticmethod
+    def _kth_largest(scores, k):
+        if len(scores) < k:
+            return -np.inf
+        return np.partition(scores, len(scores) - k)[len(scores) - k]
+
+    def top_k(self, tokens, k=5):
+        """
+        Top-k (doc_ids, scores) sorted by descending score, using MaxScore pruning:
+        terms are processed from highest to lowest upper bound and, once the remaining
+        bounds cannot lift a new chunk above the current k-th score, later terms are
+        only looked up for the surviving candidates instead of scanning their postings.
+        """
+        term_ids, qtf = self.lookup(tokens)
+        cand_docs = np.empty(0, dtype=np.int32)
+        cand_scores = np.empty(0, dtype=np.float32)
+        if not len(term_ids) or k <= 0:
+            return cand_docs, cand_scores
+        if self.idf[term_ids].min() <= 0:
+            # MaxScore needs positive contributions; the epsilon floor goes negative when the
+            # mean idf does (small or skewed corpora), so score those queries exhaustively
+            return self._top_of(*self.get_scores(tokens), k)
+
+        bounds = self.max_score[term_ids] * qtf
+        order = np.argsort(-bounds, kind="stable")
+        term_ids, qtf = term_ids[order], qtf[order]
+        # remaining[i] = best possible score still obtainable from terms i..end
+        remaining = np.append(np.cumsum(bounds[order][::-1])[::-1], 0.0)
+
+        for i, (term_id, count) in enumerate(zip(term_ids, qtf)):
+            threshold = self._kth_largest(cand_scores, k)
+            if remaining[i] <= threshold:
+                cand_scores = cand_scores + self._score_candidates(term_id, cand_docs) * count
+            else:
+                term_docs, term_contrib = self.term_postings(term_id)
+                docs = np.concatenate([cand_docs, term_docs])
+                uniq, inverse = np.unique(docs, return_inverse=True)
+                weights = np.concatenate([cand_scores, term_contrib * count])
+                cand_docs = uniq.astype(np.int32)
+                cand_scores = np.bincount(inverse, weights=weights, minlength=len(uniq)).astype(np.float32)
+
+            # Drop candidates that can no longer reach the current k-th score
+            threshold = self._kth_largest(cand_scores, k)
+            keep = cand_scores + remaining[i + 1] >= threshold
+            cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+
+        return self._top_of(cand_docs, cand_scores, k)
+
+    @staticmethod
+    def _top_of(docs, scores, k):
+        # Top k of parallel (docs, scores) arrays, sorted by descending score
+        if k <= 0:
+            return docs[:0], scores[:0]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return docs[order], scores[order]
+
+    def _weight_matrices(self):
+        from scipy import sparse
+        # term x doc matrices of precomputed BM25 contributions and of term presence, built
+        # on first batch query. Built into locals and published presence-first, so a
+        # concurrent caller that sees _weights set never finds _presence missing.
+        weights, presence = self._weights, self._presence
+        if weights is None or presence is None:
+            df = np.diff(self.indptr)
+            term_of_posting = np.repeat(np.arange(len(df)), df)
+            data = self._contrib(term_of_posting, np.asarray(self.doc_ids), np.asarray(self.tfs))
+            weights = sparse.csr_matrix(
+                (data, np.asarray(self.doc_ids), np.asarray(self.indptr)),
+                shape=(len(df), self.num_docs),
+            )
+            # Same postings with weight 1, to find every matching chunk even if its score is 0
+            presence = sparse.csr_matrix(
+                (np.ones(len(data), dtype=np.float32), np.asarray(self.doc_ids), np.asarray(self.indptr)),
+                shape=(len(df), self.num_docs),
+            )
+            self._presence = presence
+            self._weights = weights
+        return weights, presence
+
+    def top_k_batch(self, token_lists, k=5):
+        """
+        Scores many queries with one sparse (queries x terms) @ (terms x docs) product,
+        which only touches the postings of the query terms. Returns a list of
+        (doc_ids, scores) pairs, one per query, sorted by descending score.
+        """
+        from scipy import sparse
+        rows, cols, vals = [], [], []
+        for row, tokens in enumerate(token_lists):
+            term_ids, qtf = self.lookup(tokens)
+            rows.extend([row] * len(term_ids))
+            cols.extend(term_ids.tolist())
+            vals.extend(qtf.tolist())
+        queries = sparse.csr_matrix(
+            (np.asarray(vals, dtype=np.float32), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+            shape=(len(token_lists), len(self.vocab)),
+        )
+        weights, presence = self._weight_matrices()
+        scores = (queries @ weights).tocsr()
+        # Products that sum to exactly 0 are dropped from `scores`; `matches` keeps them
+        matches = (queries @ presence).tocsr()
+        matches.sort_indices()
+        scores.sort_indices()
+
+        results = []
+        for row in range(len(token_lists)):
+            docs = matches.indices[matches.indptr[row]:matches.indptr[row + 1]].astype(np.int32)
+            score_docs = scores.indices[scores.indptr[row]:scores.indptr[row + 1]]
+            row_scores = np.zeros(len(docs), dtype=np.float32)
+            row_scores[np.searchsorted(docs, score_docs)] = scores.data[scores.indptr[row]:scores.indptr[row + 1]]
+            results.append(self._top_of(docs, row_scores, k))
+        return results
+
+    def get_scores(self, tokens):
+        """
+        Score only the chunks that contain at least one query term.
+        Returns (doc_ids, scores) as parallel arrays.
+        """
+        term_ids, qtf = self.lookup(tokens)
+        if not len(term_ids):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        docs, contribs = [], []
+        for term_id, count in zip(term_ids, qtf):
+            term_docs, term_contrib = self.term_postings(term_id)
+            docs.append(term_docs)
+            contribs.append(term_contrib * count)
+        docs = np.concatenate(docs)
+        uniq, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contribs), minlength=len(uniq))
+        return uniq, scores.astype(np.float32)
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        for name in self.ARRAYS:
+            save_npy_atomic(os.path.join(index_dir, f"{name}.npy"), np.asarray(getattr(self, name)))
+        terms = [None] * len(self.vocab)
+        for term, term_id in self.vocab.items():
+            terms[term_id] = term
+        meta = {"k1": self.k1, "b": self.b, "epsilon": self.epsilon, "terms": terms}
+        with open(os.path.join(index_dir, "bm25.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        with open(os.path.join(index_dir, "bm25.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"])
+        index.vocab = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        mmap_mode = 'r' if mmap else None
+        for name in cls.ARRAYS:
+            path = os.path.join(index_dir, f"{name}.npy")
+            if os.path.exists(path):
+                setattr(index, name, np.load(path, mmap_mode=mmap_mode))
+        if index.alive is None:
+            index.alive = np.ones(index.num_docs, dtype=bool)
+        index._prepare()
+        if index.max_score is None:
+            index.max_score = index._compute_max_score()
+        return index
+
+    @staticmethod
+    def exists(index_dir):
+        return os.path.exists(os.path.join(index_dir, "bm25.json"))
@@ -0,0 +1,75 @@
+import re
+from collections import deque
+
+# Sentence ends followed by whitespace, or blank lines between paragraphs
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+
+def iter_sentences(text):
+    """Yields whitespace-normalized sentences from text in a single pass."""
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        sentence = ' '.join(text[start:match.start()].split())
+        if sentence:
+            yield sentence
+        start = match.end()
+    sentence = ' '.join(text[start:].split())
+    if sentence:
+        yield sentence
+
+
+def _split_long_sentence(sentence, num_tokens, max_tokens):
+    # Fall back to word windows for sentences that exceed the chunk budget on their own
+    words = sentence.split()
+    step = max(1, len(words) * max_tokens // num_tokens)
+    for i in range(0, len(words), step):
+        yield ' '.join(words[i:i + step])
+
+
+def iter_chunks(text, count_tokens, max_tokens=200, overlap_tokens=40, min_words=4):
+    """
+    Groups sentences into chunks of at most max_tokens tokenizer tokens. Consecutive
+    chunks share up to overlap_tokens tokens of trailing sentences. Chunks with fewer
+    than min_words words are dropped.
+    """
+    for chunk, _ in iter_page_chunks([(None, text)], count_tokens, max_tokens, overlap_tokens, min_words):
+        yield chunk
+
+
+def iter_page_chunks(pages, count_tokens, max_tokens=200, overlap_tokens=40, min_words=4):
+    """
+    Same as iter_chunks, but reads (page_no, text) pairs lazily and yields
+    (chunk, page_no) where page_no is the page the chunk starts on.
+    """
+    window = deque()  # (sentence, num_tokens, page_no)
+    window_tokens = 0
+
+    def emit():
+        chunk = ' '.join(sentence for sentence, _, _ in window)
+        return (chunk, window[0][2]) if len(chunk.split()) >= min_words else None
+
+    def pieces():
+        for page_no, text in pages:
+            for sentence in iter_sentences(text):
+                num_tokens = count_tokens(sentence)
+                if num_tokens > max_tokens:
+                    for piece in _split_long_sentence(sentence, num_tokens, max_tokens):
+                        yield piece, count_tokens(piece), page_no
+                else:
+                    yield sentence, num_tokens, page_no
+
+    for sentence, num_tokens, page_no in pieces():
+        if window and window_tokens + num_tokens > max_tokens:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            # Keep trailing sentences as overlap while they fit next to the new sentence
+            while window and (window_tokens > overlap_tokens or window_tokens + num_tokens > max_tokens):
+                window_tokens -= window.popleft()[1]
+        window.append((sentence, num_tokens, page_no))
+        window_tokens += num_tokens
+
+    if window:
+        chunk = emit()
+        if chunk:
+            yield chunk
@@ -0,0 +1,44 @@
+import time
+import numpy as np
+
+
+def embed_texts(model, texts, batch_size=64, multi_process=False, out_path=None, log_every=50):
+    """
+    Encodes texts into a preallocated float32 array (a memory-mapped .npy file when
+    out_path is given). Texts are sorted by length so each batch pads to similar
+    lengths; rows are written back in input order. With multi_process=True the
+    SentenceTransformer multi-process pool spreads the work over all CPU cores.
+    """
+    num_texts = len(texts)
+    dim = model.get_sentence_embedding_dimension()
+    if out_path is not None:
+        out = np.lib.format.open_memmap(out_path, mode='w+', dtype='float32', shape=(num_texts, dim))
+    else:
+        out = np.empty((num_texts, dim), dtype='float32')
+    if not num_texts:
+        return out
+
+    # Longest first, so memory peaks (if any) show up in the first batch
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    sorted_texts = [texts[i] for i in order]
+
+    start = time.perf_counter()
+    if multi_process:
+        pool = model.start_multi_process_pool()
+        try:
+            out[order] = model.encode_multi_process(sorted_texts, pool, batch_size=batch_size)
+        finally:
+            model.stop_multi_process_pool(pool)
+    else:
+        num_batches = (num_texts + batch_size - 1) // batch_size
+        for batch_no, batch_start in enumerate(range(0, num_texts, batch_size), 1):
+            rows = order[batch_start:batch_start + batch_size]
+            out[rows] = model.encode(sorted_texts[batch_start:batch_start + batch_size], batch_size=batch_size)
+            if log_every and batch_no % log_every == 0:
+                print(f"  embedded batch {batch_no}/{num_batches}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {num_texts} chunks in {elapsed:.1f}s ({num_texts / max(elapsed, 1e-9):.1f} chunks/sec)")
+    if out_path is not None:
+        out.flush()
+    return out
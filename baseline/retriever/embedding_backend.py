@@ -0,0 +1,80 @@
+import os
+import time
+import pickle
+import argparse
+import numpy as np
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+# Dynamically quantized ONNX exports shipped in the Hub repo, per CPU instruction set
+INT8_VARIANTS = {
+    "avx2": "onnx/model_quint8_avx2.onnx",
+    "avx512": "onnx/model_qint8_avx512.onnx",
+    "avx512_vnni": "onnx/model_qint8_avx512_vnni.onnx",
+    "arm64": "onnx/model_qint8_arm64.onnx",
+}
+
+
+def load_embedding_model(backend="torch", model_name=EMBEDDING_MODEL, int8_variant="avx512_vnni"):
+    """
+    Loads the sentence embedder on CPU with the given backend:
+    "torch" (PyTorch fp32), "onnx" (ONNX Runtime fp32) or "onnx-int8"
+    (ONNX Runtime with the dynamically quantized int8 export shipped on the Hub).
+    int8_variant picks the export matching the host: "avx2", "avx512",
+    "avx512_vnni" or "arm64" (see INT8_VARIANTS).
+    """
+    # Imported here because sentence_transformers pulls in torch
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(model_name, device='cpu')
+    if backend == "onnx":
+        return SentenceTransformer(model_name, device='cpu', backend="onnx")
+    if backend == "onnx-int8":
+        if int8_variant not in INT8_VARIANTS:
+            raise ValueError(f"Unsupported int8 variant: {int8_variant}. Choose from {sorted(INT8_VARIANTS)}")
+        return SentenceTransformer(model_name, device='cpu', backend="onnx",
+                                   model_kwargs={"file_name": INT8_VARIANTS[int8_variant]})
+    raise ValueError(f"Unsupported embedding backend: {backend}. Choose from {BACKENDS}")
+
+
+def parity_check(texts, backend, reference="torch", batch_size=64, int8_variant="avx512_vnni"):
+    """
+    Encodes texts with both backends and reports per-text cosine agreement and
+    encode throughput, so a faster backend can be validated before it is deployed.
+    """
+    report = {}
+    vectors = {}
+    for name in (reference, backend):
+        model = load_embedding_model(name, int8_variant=int8_variant)
+        start = time.perf_counter()
+        vectors[name] = model.encode(texts, batch_size=batch_size).astype('float32')
+        report[f"{name}_texts_per_sec"] = len(texts) / max(time.perf_counter() - start, 1e-9)
+
+    ref, other = vectors[reference], vectors[backend]
+    if ref.shape != other.shape:
+        raise ValueError(f"Shape mismatch: {reference} {ref.shape} vs {backend} {other.shape}")
+    cosine = np.sum(ref * other, axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(other, axis=1) + 1e-12)
+    report.update({
+        "shape": list(ref.shape),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+    })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare an embedding backend against the PyTorch embedder.")
+    parser.add_argument("--backend", type=str, default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--index-dir", type=str, required=True, help="Saved retriever index to sample chunk texts from.")
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--int8-variant", type=str, default="avx512_vnni", choices=sorted(INT8_VARIANTS))
+    args = parser.parse_args()
+
+    with open(os.path.join(args.index_dir, "metadata.pkl"), "rb") as f:
+        texts = [text for text in pickle.load(f)["texts"] if text]
+    rng = np.random.default_rng(0)
+    sample = [texts[i] for i in rng.choice(len(texts), min(args.samples, len(texts)), replace=False)]
+    for key, value in parity_check(sample, args.backend, int8_variant=args.int8_variant).items():
+        print(f"{key}: {value}")
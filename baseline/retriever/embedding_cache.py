@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings keyed on normalized query text.
+    Entries older than ttl seconds (if set) are treated as misses. model names the
+    embedder (and backend) the vectors came from; a saved cache from another is ignored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, model=""):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (vector, created_at)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        # all-MiniLM-L6-v2 is uncased, so case and spacing do not change the embedding
+        return " ".join(text.lower().split())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, text):
+        key = self.normalize(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1], time.time()):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, text, vector):
+        key = self.normalize(text)
+        with self._lock:
+            self._entries[key] = (np.asarray(vector, dtype='float32'), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self, path):
+        with self._lock:
+            keys = list(self._entries.keys())
+            vectors = [vec for vec, _ in self._entries.values()]
+            created = [ts for _, ts in self._entries.values()]
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Plain unicode arrays, so loading never needs pickle
+        np.savez(path, keys=np.array(keys, dtype=str), vectors=np.stack(vectors),
+                 created=np.array(created, dtype=np.float64), model=np.array(self.model, dtype=str))
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        data = np.load(path, allow_pickle=False)
+        try:
+            model = str(data["model"]) if "model" in data.files else None
+            keys = data["keys"]
+        except ValueError:
+            # Older caches stored keys as a pickled object array
+            print(f"Ignoring query cache {path}: outdated format")
+            return
+        if model != self.model:
+            print(f"Ignoring query cache {path}: built with {model or 'an unknown model'}, not {self.model}")
+            return
+        now = time.time()
+        with self._lock:
+            # Stored in LRU order, so the most recently used entries survive a smaller maxsize
+            for key, vector, created_at in zip(keys, data["vectors"], data["created"]):
+                if self._expired(created_at, now):
+                    continue
+                self._entries[str(key)] = (vector, float(created_at))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
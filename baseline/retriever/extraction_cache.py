@@ -0,0 +1,84 @@
+import os
+import re
+import gzip
+import json
+from retriever.utils import file_sha256
+
+
+def normalize_text(text):
+    # Collapse runs of spaces and blank lines but keep paragraph breaks for the chunker
+    text = re.sub(r'[ \t\f\v\r]+', ' ', text)
+    text = re.sub(r' ?\n[\n ]*\n ?', '\n\n', text)
+    return text.strip()
+
+
+class ExtractionCache:
+    """
+    On-disk cache of extracted document text, addressed by the SHA-256 of the source
+    file. Each entry is a gzip-compressed JSON-lines file of [page_no, text] pairs.
+    A size + mtime match against index.json skips re-hashing unchanged files.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, self.INDEX_FILE)
+        self._index = {}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                self._index = json.load(f)
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.jsonl.gz")
+
+    def digest(self, path):
+        """SHA-256 of the file, reusing the recorded digest if size and mtime are unchanged."""
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self._index.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+        digest = file_sha256(path)
+        self._index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        self._save_index()
+        return digest
+
+    def contains(self, path):
+        return os.path.exists(self._blob_path(self.digest(path)))
+
+    def read(self, path):
+        """Yields the cached (page_no, text) pairs of a file, one page at a time."""
+        with gzip.open(self._blob_path(self.digest(path)), "rt", encoding="utf-8") as f:
+            for line in f:
+                page_no, text = json.loads(line)
+                yield page_no, text
+
+    def store(self, path, pages):
+        """
+        Passes (page_no, text) pairs through while writing them to the cache. The entry
+        is only committed if the pages are consumed to the end; an exception from pages
+        (e.g. ExtractionError) discards it and is re-raised.
+        """
+        blob_path = self._blob_path(self.digest(path))
+        tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+        completed = False
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                for page_no, text in pages:
+                    text = normalize_text(text)
+                    f.write(json.dumps([page_no, text]) + "\n")
+                    yield page_no, text
+            completed = True
+        finally:
+            if completed:
+                os.replace(tmp_path, blob_path)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+SEARCH_PARAMS = ("nprobe", "efSearch")
+CONFIG_FILE = "index_config.json"
+
+
+def build_faiss_index(embeddings, index_spec="Flat", train_size=100000, seed=0):
+    """
+    Builds a FAISS index from an index_factory string such as "Flat", "IVF4096,PQ32"
+    or "HNSW32". Indexes that need training are trained on a random sample of at
+    most train_size vectors before all embeddings are added with ids 0..n-1, so rows
+    can later be removed or appended by id. IVF indexes store those ids themselves;
+    every other index is wrapped in an IndexIDMap2.
+    """
+    import faiss
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    dim = embeddings.shape[1]
+    if index_spec == "Flat":
+        index = faiss.IndexFlatL2(dim)
+    else:
+        index = faiss.index_factory(dim, index_spec, faiss.METRIC_L2)
+
+    if not index.is_trained:
+        sample = embeddings
+        if len(embeddings) > train_size:
+            rng = np.random.default_rng(seed)
+            sample = embeddings[np.sort(rng.choice(len(embeddings), train_size, replace=False))]
+        print(f"Training {index_spec} index on {len(sample)} vectors...")
+        index.train(sample)
+    if not stores_ids(index):
+        index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, np.arange(len(embeddings), dtype='int64'))
+    return index
+
+
+def stores_ids(index):
+    """
+    True for (possibly pre-transformed) IVF indexes not wrapped in an IndexIDMap. Their
+    inverted lists keep the ids given to add_with_ids and remove_ids leaves the others
+    untouched, whereas IndexIDMap assumes removal renumbers the inner rows like a flat
+    index does, so an IndexIDMap around an IVF index maps to the wrong rows after a removal.
+    """
+    import faiss
+    if isinstance(index, faiss.IndexIDMap):
+        return False
+    try:
+        faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return False
+    return True
+
+
+def wraps_ivf(index):
+    """True for an IndexIDMap around an IVF index (built before IVF kept its own ids)."""
+    import faiss
+    return isinstance(index, faiss.IndexIDMap) and stores_ids(faiss.downcast_index(index.index))
+
+
+def ensure_id_map(index):
+    """
+    Converts a flat index saved without ids (older indexes) into an IndexIDMap2 whose
+    ids are the existing sequential positions. FAISS can only wrap an empty index,
+    so the stored vectors are copied into a fresh flat index; nothing is re-encoded.
+    """
+    import faiss
+    if isinstance(index, faiss.IndexIDMap) or stores_ids(index):
+        return index
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError(f"Cannot add ids to a populated {type(index).__name__}; rebuild the index instead.")
+    id_map = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+    id_map.add_with_ids(index.reconstruct_n(0, index.ntotal), np.arange(index.ntotal, dtype='int64'))
+    return id_map
+
+
+def base_index(index):
+    """Returns the underlying index of an IndexIDMap wrapper."""
+    import faiss
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def set_search_params(index, params):
+    """Applies nprobe / efSearch where the index supports them; unsupported keys are ignored."""
+    import faiss
+    space = faiss.ParameterSpace()
+    for name in SEARCH_PARAMS:
+        value = params.get(name)
+        if value is None:
+            continue
+        try:
+            space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+
+def save_index_config(index_dir, config):
+    with open(os.path.join(index_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+
+
+def load_index_config(index_dir):
+    path = os.path.join(index_dir, CONFIG_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def recall_latency_report(embeddings, index_spec, k=10, num_queries=500,
+                          nprobe_values=(1, 4, 16, 64), ef_values=(16, 32, 64, 128), seed=0):
+    """
+    Compares an approximate index against exact (flat) search on queries sampled
+    from the corpus. Returns one row per search setting with recall@k and mean
+    per-query latency in milliseconds.
+    """
+    import faiss
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), min(num_queries, len(embeddings)), replace=False)]
+
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    # Keep the IndexIDMap2 wrapper alive: it owns the inner index that base_index returns
+    wrapped = build_faiss_index(embeddings, index_spec)
+    index = base_index(wrapped)
+    if "IVF" in index_spec:
+        settings = [{"nprobe": v} for v in nprobe_values]
+    elif "HNSW" in index_spec:
+        settings = [{"efSearch": v} for v in ef_values]
+    else:
+        settings = [{}]
+
+    rows = [{"index_spec": "Flat", "params": {}, "recall": 1.0, "latency_ms": flat_ms}]
+    for params in settings:
+        set_search_params(index, params)
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        rows.append({
+            "index_spec": index_spec,
+            "params": params,
+            "recall": hits / truth.size,
+            "latency_ms": latency_ms,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of an approximate FAISS index against flat search.")
+    parser.add_argument("--index-dir", type=str, required=True, help="Saved retriever index containing embeddings.npy.")
+    parser.add_argument("--spec", type=str, required=True, help="FAISS index_factory string, e.g. IVF4096,PQ32 or HNSW32.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    vectors = np.load(os.path.join(args.index_dir, "embeddings.npy"), mmap_mode='r')
+    for row in recall_latency_report(vectors, args.spec, k=args.k, num_queries=args.queries):
+        print(f"{row['index_spec']:<20} {json.dumps(row['params']):<20} "
+              f"recall@{args.k}={row['recall']:.3f}  {row['latency_ms']:.3f} ms/query")
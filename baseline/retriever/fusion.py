@@ -0,0 +1,69 @@
+import numpy as np
+
+FUSION_METHODS = ("rrf", "minmax", "zscore", "concat")
+
+
+def _minmax(scores):
+    if not len(scores):
+        return scores
+    span = scores.max() - scores.min()
+    if span == 0:
+        return np.ones_like(scores)
+    return (scores - scores.min()) / span
+
+
+def _zscore(scores):
+    if not len(scores):
+        return scores
+    std = scores.std()
+    if std == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def fuse(bm25_ids, bm25_scores, faiss_ids, faiss_dists, k=5, method="rrf", alpha=0.5, rrf_k=60):
+    """
+    Fuses a BM25 ranking (higher score is better) with a FAISS ranking (lower L2
+    distance is better) into one top-k list, deduplicated by chunk index.
+    alpha weights the BM25 branch and (1 - alpha) the FAISS branch.
+    Returns (chunk_indices, fused_scores) sorted by descending fused score.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unsupported fusion method: {method}. Choose from {FUSION_METHODS}")
+
+    bm25_ids = np.asarray(bm25_ids, dtype=np.int64)
+    faiss_ids = np.asarray(faiss_ids, dtype=np.int64)
+    bm25_scores = np.asarray(bm25_scores, dtype=np.float64)
+    faiss_dists = np.asarray(faiss_dists, dtype=np.float64)
+    valid = faiss_ids != -1
+    faiss_ids, faiss_dists = faiss_ids[valid], faiss_dists[valid]
+
+    if method == "concat":
+        # Previous behaviour: BM25 hits first, then unseen FAISS hits
+        ids = np.concatenate([bm25_ids, faiss_ids])
+        _, first = np.unique(ids, return_index=True)
+        first = np.sort(first)[:k]
+        return ids[first], np.concatenate([bm25_scores, -faiss_dists])[first]
+
+    if method == "rrf":
+        bm25_part = 1.0 / (rrf_k + np.arange(1, len(bm25_ids) + 1))
+        faiss_part = 1.0 / (rrf_k + np.arange(1, len(faiss_ids) + 1))
+    elif method == "minmax":
+        bm25_part = _minmax(bm25_scores)
+        faiss_part = _minmax(-faiss_dists)
+    else:
+        bm25_part = _zscore(bm25_scores)
+        faiss_part = _zscore(-faiss_dists)
+
+    ids = np.concatenate([bm25_ids, faiss_ids])
+    if not len(ids):
+        return ids, np.empty(0, dtype=np.float64)
+    weights = np.concatenate([alpha * bm25_part, (1 - alpha) * faiss_part])
+    uniq, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=weights, minlength=len(uniq))
+
+    if len(fused) > k > 0:
+        top = np.argpartition(-fused, k - 1)[:k]
+        uniq, fused = uniq[top], fused[top]
+    order = np.argsort(-fused, kind="stable")[:max(k, 0)]
+    return uniq[order], fused[order]
@@ -1,114 +1,404 @@
 import os
+import re
+import time
 import pickle
-import faiss
+import threading
 import numpy as np
-from rank_bm25 import BM25Okapi
-from nltk.tokenize import word_tokenize
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from retriever.bm25_index import BM25Index
+from retriever.faiss_index import (build_faiss_index, ensure_id_map, set_search_params,
+                                   save_index_config, load_index_config, wraps_ivf)
+from retriever.fusion import fuse
+from retriever.embedding_cache import QueryEmbeddingCache
+from retriever.chunker import iter_page_chunks
+from retriever.embedder import embed_texts
+from retriever.embedding_backend import load_embedding_model, EMBEDDING_MODEL
+from retriever.utils import save_npy_atomic
+
+CHUNK_ID = re.compile(r"chunk\d+$")
+
+def word_tokenize(text):
+    # nltk is imported on first use to keep `import retriever.retriever` cheap
+    from nltk.tokenize import word_tokenize as nltk_word_tokenize
+    return nltk_word_tokenize(text)
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
 
 class Retriever:
-    def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
+    def __init__(self, index_spec="Flat", nprobe=None, ef_search=None, train_size=100000,
+                 fusion="rrf", alpha=0.5, rrf_k=60, parallel=False, max_workers=2,
+                 query_cache_size=1024, query_cache_ttl=None, multi_process=False, embedding_backend="torch",
+                 compact_threshold=0.25):
+        # "torch", "onnx" or "onnx-int8"; all produce the same 384-d all-MiniLM-L6-v2 vectors
+        self.embedding_backend = embedding_backend
+        # The embedder is loaded on first use (see the model property) or by warm_up()
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.load_times = {}
+        # FAISS index_factory string, e.g. "Flat", "IVF4096,PQ32" or "HNSW32"
+        self.index_spec = index_spec
+        self.search_params = {"nprobe": nprobe, "efSearch": ef_search}
+        self.train_size = train_size
+        # Hybrid retrieval: how BM25 and FAISS rankings are combined
+        self.fusion = fusion
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+        # Run the BM25 and FAISS branches on a shared thread pool (both release the GIL)
+        self.parallel = parallel
+        self.max_workers = max_workers
+        self._pool = None
+        # LRU cache of query embeddings; query_cache_size=0 disables it
+        self.query_cache = (QueryEmbeddingCache(query_cache_size, query_cache_ttl,
+                                                model=f"{EMBEDDING_MODEL}:{embedding_backend}")
+                            if query_cache_size else None)
+        # Encode documents with SentenceTransformer's multi-process pool (one worker per core)
+        self.multi_process = multi_process
+        # Deleted vectors still stored in FAISS (indexes without remove_ids, e.g. HNSW);
+        # once they exceed compact_threshold of the index it is rebuilt from the live rows
+        self.dead_vectors = 0
+        self.compact_threshold = compact_threshold
         self.index = None
         self.documents = []
         self.embeddings = None
         self.chunk_ids = []
-        self.tokenized_corpus = []
-        self.bm25_model = None
+        self.bm25_index = None
 
-    def clean_chunk(self, chunk):
-        cleaned = ' '.join(chunk.split())
-        return cleaned if len(cleaned.split()) > 3 else ""
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = load_embedding_model(self.embedding_backend)
+                    self.load_times["embedder"] = time.perf_counter() - start
+                    print(f"Loaded embedding model ({self.embedding_backend}) in {self.load_times['embedder']:.1f}s")
+        return self._model
 
-    def add_documents(self, documents, chunk_size=500):
-        self.documents = []
-        self.chunk_ids = []
+    def warm_up(self):
+        """Loads the embedder on a background thread; returns the thread."""
+        thread = threading.Thread(target=lambda: self.model, name="retriever-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def count_tokens(self, text):
+        return len(self.model.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def iter_chunks(self, documents, chunk_tokens=200, overlap_tokens=40):
+        """
+        Streams chunk dicts document by document; documents may itself be a generator.
+        A document has either "text" or "pages", an iterable of (page_no, text).
+        """
         for doc in documents:
-            text = doc["text"]
             doc_id = doc["id"]
-            chunks = [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
-            for idx, chunk in enumerate(chunks):
-                clean_chunk = self.clean_chunk(chunk)
-                if not clean_chunk:
-                    continue
-                chunk_id = f"{doc_id}chunk{idx}"
-                self.chunk_ids.append(chunk_id)
-                self.documents.append({"id": chunk_id, "text": clean_chunk})
+            pages = doc["pages"] if "pages" in doc else [(None, doc["text"])]
+            chunks = iter_page_chunks(pages, self.count_tokens, chunk_tokens, overlap_tokens)
+            for idx, (chunk, page_no) in enumerate(chunks):
+                yield {"id": f"{doc_id}chunk{idx}", "doc_id": doc_id, "text": chunk, "page": page_no}
+
+    def _ingest(self, documents, chunk_tokens, overlap_tokens, batch_size, embeddings_path=None):
+        chunks = []
+        tokenized_corpus = []
+        # Single pass over the documents: each chunk is stored and tokenized for BM25
+        for chunk in self.iter_chunks(documents, chunk_tokens, overlap_tokens):
+            chunks.append(chunk)
+            tokenized_corpus.append(word_tokenize(chunk["text"].lower()))
+
+        embeddings = embed_texts(self.model, [chunk["text"] for chunk in chunks], batch_size=batch_size,
+                                 multi_process=self.multi_process, out_path=embeddings_path)
+        return chunks, tokenized_corpus, embeddings
+
+    def add_documents(self, documents, chunk_tokens=200, overlap_tokens=40, batch_size=64, embeddings_path=None):
+        """
+        Builds the FAISS and BM25 indexes from scratch. With embeddings_path, vectors are
+        written straight into a memory-mapped .npy file instead of RAM.
+        """
+        chunks, tokenized_corpus, self.embeddings = self._ingest(
+            documents, chunk_tokens, overlap_tokens, batch_size, embeddings_path)
+        self.documents = chunks
+        self.chunk_ids = [chunk["id"] for chunk in chunks]
 
         # FAISS embeddings
-        texts = [d["text"] for d in self.documents]
-        self.embeddings = self.model.encode(texts, show_progress_bar=True).astype('float32')
-        dim = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dim)
-        self.index.add(self.embeddings)
+        self.index = build_faiss_index(self.embeddings, self.index_spec, self.train_size)
+        set_search_params(self.index, self.search_params)
+        self.dead_vectors = 0
 
         # BM25
-        self.tokenized_corpus = [word_tokenize(doc["text"].lower()) for doc in self.documents]
-        self.bm25_model = BM25Okapi(self.tokenized_corpus)
+        self.bm25_index = BM25Index.build(tokenized_corpus)
+
+    def doc_rows(self, doc_ids=None):
+        """Maps doc_id -> row positions of its live chunks."""
+        rows = {}
+        for row, chunk in enumerate(self.documents):
+            if chunk is not None and (doc_ids is None or chunk["doc_id"] in doc_ids):
+                rows.setdefault(chunk["doc_id"], []).append(row)
+        return rows
+
+    def delete_documents(self, doc_ids):
+        """
+        Removes every chunk of the given documents from FAISS and BM25. Rows are
+        tombstoned (set to None) rather than renumbered, so FAISS ids stay stable.
+        """
+        if wraps_ivf(self.index) and self.doc_rows(set(doc_ids)):
+            # Removing through an IndexIDMap would misalign its ids with the IVF lists
+            print("Rebuilding the IVF index without an id map before removing documents...")
+            self.compact()
+        rows = [row for doc_rows in self.doc_rows(set(doc_ids)).values() for row in doc_rows]
+        if not rows:
+            return 0
+        self.index = ensure_id_map(self.index)
+        removed = True
+        try:
+            self.index.remove_ids(np.asarray(rows, dtype='int64'))
+        except RuntimeError:
+            removed = False
+        self.bm25_index.delete(rows)
+        for row in rows:
+            self.documents[row] = None
+            self.chunk_ids[row] = None
+        if not removed:
+            # HNSW cannot remove vectors; tombstoned rows are skipped at search time instead
+            self.dead_vectors += len(rows)
+            print(f"{self.index_spec} index does not support removal; {self.dead_vectors} deleted "
+                  f"vector(s) of {self.index.ntotal} are masked until the index is compacted.")
+            if self.dead_vectors > self.compact_threshold * self.index.ntotal:
+                self.compact()
+        return len(rows)
+
+    def compact(self):
+        """
+        Rebuilds FAISS and BM25 from the live rows only, dropping tombstones. Stored
+        embeddings are reused, so nothing is re-encoded; row ids are renumbered.
+        """
+        live = [row for row, chunk in enumerate(self.documents) if chunk is not None]
+        print(f"Compacting index: {len(self.documents) - len(live)} deleted row(s) dropped, {len(live)} kept.")
+        self.documents = [self.documents[row] for row in live]
+        self.chunk_ids = [chunk["id"] for chunk in self.documents]
+        self.embeddings = np.ascontiguousarray(self.embeddings[live], dtype='float32')
+        self.index = build_faiss_index(self.embeddings, self.index_spec, self.train_size)
+        set_search_params(self.index, self.search_params)
+        self.bm25_index = BM25Index.build([word_tokenize(chunk["text"].lower()) for chunk in self.documents])
+        self.dead_vectors = 0
+
+    def upsert_documents(self, documents, chunk_tokens=200, overlap_tokens=40, batch_size=64):
+        """
+        Adds new documents and replaces existing ones with the same id, embedding and
+        tokenizing only the given documents. Returns the number of chunks added.
+        """
+        if self.index is None:
+            self.add_documents(documents, chunk_tokens, overlap_tokens, batch_size)
+            return len(self.documents)
+        documents = list(documents)
+        self.delete_documents([doc["id"] for doc in documents])
+        chunks, tokenized_corpus, embeddings = self._ingest(documents, chunk_tokens, overlap_tokens, batch_size)
+        if not chunks:
+            return 0
+
+        start = len(self.documents)
+        self.index = ensure_id_map(self.index)
+        self.index.add_with_ids(embeddings, np.arange(start, start + len(chunks), dtype='int64'))
+        self.bm25_index.append(tokenized_corpus)
+        self.embeddings = np.vstack([self.embeddings, embeddings])
+        self.documents.extend(chunks)
+        self.chunk_ids.extend(chunk["id"] for chunk in chunks)
+        return len(chunks)
 
     def save(self, index_dir):
         os.makedirs(index_dir, exist_ok=True)
+        import faiss
         faiss.write_index(self.index, os.path.join(index_dir, "faiss.index"))
+        save_index_config(index_dir, {"index_spec": self.index_spec, **self.search_params})
         metadata = {
             "chunk_ids": self.chunk_ids,
-            "texts": [doc["text"] for doc in self.documents]
+            "doc_ids": [doc["doc_id"] if doc else None for doc in self.documents],
+            "pages": [doc["page"] if doc else None for doc in self.documents],
+            "texts": [doc["text"] if doc else None for doc in self.documents]
         }
         with open(os.path.join(index_dir, "metadata.pkl"), "wb") as f:
             pickle.dump(metadata, f)
+        # Persist vectors so load() can memory-map them instead of re-encoding
+        save_npy_atomic(os.path.join(index_dir, "embeddings.npy"), np.ascontiguousarray(self.embeddings, dtype='float32'))
+        self.bm25_index.save(os.path.join(index_dir, "bm25"))
 
     def load(self, index_dir):
+        import faiss
         self.index = faiss.read_index(os.path.join(index_dir, "faiss.index"))
+        config = load_index_config(index_dir)
+        self.index_spec = config.get("index_spec", "Flat")
+        # Explicit constructor arguments override the persisted operating point
+        for name in self.search_params:
+            if self.search_params[name] is None:
+                self.search_params[name] = config.get(name)
+        set_search_params(self.index, self.search_params)
         print("Loading documents...")
         with open(os.path.join(index_dir, "metadata.pkl"), "rb") as f:
             metadata = pickle.load(f)
 
         self.chunk_ids = metadata["chunk_ids"]
         texts = metadata["texts"]
-        self.documents = [{"id": cid, "text": txt} for cid, txt in zip(self.chunk_ids, texts)]
-        print("Tokenizing corpus for BM25...")
-        self.tokenized_corpus = [word_tokenize(txt.lower()) for txt in texts]
-        print("Initializing BM25 model...")
-        self.bm25_model = BM25Okapi(self.tokenized_corpus)
+        # Older indexes do not store doc ids; recover them from "<doc_id>chunk<n>"
+        doc_ids = metadata.get("doc_ids") or [CHUNK_ID.sub("", cid) for cid in self.chunk_ids]
+        pages = metadata.get("pages") or [None] * len(self.chunk_ids)
+        self.documents = [
+            {"id": cid, "doc_id": did, "text": txt, "page": page} if cid is not None else None
+            for cid, did, txt, page in zip(self.chunk_ids, doc_ids, texts, pages)
+        ]
+        bm25_dir = os.path.join(index_dir, "bm25")
+        if BM25Index.exists(bm25_dir):
+            print("Memory-mapping BM25 index...")
+            self.bm25_index = BM25Index.load(bm25_dir)
+        else:
+            print("Tokenizing corpus for BM25...")
+            self.bm25_index = BM25Index.build([word_tokenize(txt.lower()) for txt in texts])
+        self.embeddings = self._load_embeddings(index_dir)
+        self.dead_vectors = self.index.ntotal - sum(chunk is not None for chunk in self.documents)
+        print("Load complete.")
+
+    def _load_embeddings(self, index_dir):
+        emb_path = os.path.join(index_dir, "embeddings.npy")
+        if os.path.exists(emb_path):
+            print("Memory-mapping embeddings...")
+            return np.load(emb_path, mmap_mode='r')
+        # Older indexes have no embeddings.npy: rebuild from the flat index if possible
+        import faiss
+        if isinstance(self.index, faiss.IndexFlat):
+            print("Reconstructing embeddings from FAISS index...")
+            return self.index.reconstruct_n(0, self.index.ntotal)
         print("Encoding embeddings...")
-        self.embeddings = self.model.encode([d["text"] for d in self.documents], show_progress_bar=True)
-        print("Load complete.")  
+        texts = [d["text"] for d in self.documents]
+        return self.model.encode(texts, show_progress_bar=True).astype('float32')
 
-    def query_faiss(self, query, k=5):
-        query_emb = self.model.encode([query]).astype('float32')
-        distances, indices = self.index.search(query_emb, k)
+    def _to_results(self, indices, scores):
         results = []
-        for idx, dist in zip(indices[0], distances[0]):
-            if idx == -1:
+        for idx, score in zip(indices, scores):
+            if idx == -1 or self.documents[idx] is None:
                 continue
             results.append({
                 "chunk_id": self.chunk_ids[idx],
                 "text": self.documents[idx]["text"],
-                "distance": float(dist)
+                "page": self.documents[idx]["page"],
+                "distance": float(score)
             })
         return results
 
+    def _encode_queries(self, queries):
+        queries = list(queries)
+        if self.query_cache is None:
+            return self.model.encode(queries).astype('float32')
+        cached = [self.query_cache.get(query) for query in queries]
+        missing = [i for i, vec in enumerate(cached) if vec is None]
+        if missing:
+            # One forward pass for all cache misses
+            new_embs = self.model.encode([queries[i] for i in missing]).astype('float32')
+            for i, vec in zip(missing, new_embs):
+                self.query_cache.put(queries[i], vec)
+                cached[i] = vec
+        return np.stack(cached).astype('float32')
+
+    def save_query_cache(self, path):
+        if self.query_cache is not None:
+            self.query_cache.save(path)
+
+    def load_query_cache(self, path):
+        if self.query_cache is not None:
+            self.query_cache.load(path)
+
+    def _search_faiss(self, queries, k):
+        # One forward pass and one matrix search for the whole batch
+        query_embs = self._encode_queries(queries)
+        if not self.dead_vectors:
+            return self.index.search(query_embs, k)
+        # Over-fetch so masked (deleted) vectors do not take result slots
+        distances, indices = self.index.search(query_embs, min(k + self.dead_vectors, self.index.ntotal))
+        out_dists = np.full((len(queries), k), np.inf, dtype='float32')
+        out_ids = np.full((len(queries), k), -1, dtype='int64')
+        for q, (row_dist, row_idx) in enumerate(zip(distances, indices)):
+            keep = [j for j, idx in enumerate(row_idx) if idx != -1 and self.documents[idx] is not None][:k]
+            out_dists[q, :len(keep)] = row_dist[keep]
+            out_ids[q, :len(keep)] = row_idx[keep]
+        return out_dists, out_ids
+
+    def _search_bm25(self, queries, k):
+        token_lists = [word_tokenize(query.lower()) for query in queries]
+        if len(token_lists) == 1:
+            return [self.bm25_index.top_k(token_lists[0], k)]
+        return self.bm25_index.top_k_batch(token_lists, k)
+
+    def query_faiss(self, query, k=5):
+        return self.query_faiss_batch([query], k)[0]
+
+    def query_faiss_batch(self, queries, k=5):
+        if not queries:
+            return []
+        distances, indices = self._search_faiss(queries, k)
+        return [self._to_results(row_idx, row_dist) for row_idx, row_dist in zip(indices, distances)]
+
     def query_bm25(self, query, k=5):
-        scores = self.bm25_model.get_scores(word_tokenize(query.lower()))
-        ranked_indices = np.argsort(scores)[::-1][:k]
+        return self.query_bm25_batch([query], k)[0]
+
+    def query_bm25_batch(self, queries, k=5):
+        if not queries:
+            return []
+        return [self._to_results(doc_ids, scores) for doc_ids, scores in self._search_bm25(queries, k)]
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="retriever")
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def hybrid_query(self, query, k=5, fusion=None, alpha=None, candidates=None, return_timings=False):
+        output = self.hybrid_query_batch([query], k, fusion, alpha, candidates, return_timings)
+        if return_timings:
+            return {"results": output["results"][0], "timings": output["timings"]}
+        return output[0]
+
+    def hybrid_query_batch(self, queries, k=5, fusion=None, alpha=None, candidates=None, return_timings=False):
+        """
+        Retrieves `candidates` chunks per branch (default k) and fuses them into k results.
+        fusion: "rrf", "minmax", "zscore" or "concat" (BM25 first); alpha weights BM25
+        against FAISS. Defaults come from the constructor.
+        With return_timings=True returns {"results": [...], "timings": {...}} in milliseconds.
+        """
+        if not queries:
+            return {"results": [], "timings": {}} if return_timings else []
+        fusion = fusion or self.fusion
+        alpha = self.alpha if alpha is None else alpha
+        candidates = candidates or k
+
+        start = time.perf_counter()
+        if self.parallel:
+            pool = self._get_pool()
+            bm25_future = pool.submit(_timed, self._search_bm25, queries, candidates)
+            faiss_future = pool.submit(_timed, self._search_faiss, queries, candidates)
+            bm25_batch, bm25_ms = bm25_future.result()
+            (distances, indices), faiss_ms = faiss_future.result()
+        else:
+            bm25_batch, bm25_ms = _timed(self._search_bm25, queries, candidates)
+            (distances, indices), faiss_ms = _timed(self._search_faiss, queries, candidates)
+        retrieval_ms = (time.perf_counter() - start) * 1000
+
         results = []
-        for idx in ranked_indices:
-            results.append({
-                "chunk_id": self.chunk_ids[idx],
-                "text": self.documents[idx]["text"],
-                "distance": float(scores[idx])
-            })
-        return results
+        for (bm25_ids, bm25_scores), faiss_ids, faiss_dists in zip(bm25_batch, indices, distances):
+            ids, scores = fuse(bm25_ids, bm25_scores, faiss_ids, faiss_dists, k,
+                               method=fusion, alpha=alpha, rrf_k=self.rrf_k)
+            results.append(self._to_results(ids, scores))
 
-    def hybrid_query(self, query, k=5):
-        bm25_results = self.query_bm25(query, k)
-        faiss_results = self.query_faiss(query, k)
-        combined = bm25_results + faiss_results
-        seen = set()
-        hybrid = []
-        for res in combined:
-            if res["text"] not in seen:
-                seen.add(res["text"])
-                hybrid.append(res)
-            if len(hybrid) >= k:
-                break
-        return hybrid
+        if not return_timings:
+            return results
+        total_ms = (time.perf_counter() - start) * 1000
+        timings = {
+            "bm25_ms": bm25_ms,
+            "faiss_ms": faiss_ms,
+            "retrieval_ms": retrieval_ms,
+            "fusion_ms": total_ms - retrieval_ms,
+            "total_ms": total_ms,
+            "parallel": self.parallel,
+        }
+        return {"results": results, "timings": timings}
@@ -1,15 +1,77 @@
-import fitz  # PyMuPDF
+import os
+import time
+import hashlib
+import numpy as np
+
+class ExtractionError(Exception):
+    """A file (or part of it) could not be read; its text must not be cached or trusted as complete."""
+
+
+def iter_pdf_pages(pdf_path, start=0, end=None):
+    """
+    Yields (page_no, text) for pages [start, end) of a PDF, one page at a time.
+    page_no is 1-based so it can be shown to users as-is. Read errors are raised.
+    """
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        end = doc.page_count if end is None else min(end, doc.page_count)
+        for page_idx in range(start, end):
+            yield page_idx + 1, doc[page_idx].get_text()
+
 
 def extract_text_from_pdf(pdf_path):
     """
     Extracts and concatenates text from a PDF file.
     Returns one string containing all text.
     """
-    text = ""
     try:
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text += page.get_text()
+        return "".join(text for _, text in iter_pdf_pages(pdf_path)).strip()
     except Exception as e:
         print(f"Error reading {pdf_path}: {e}")
-    return text.strip()
+        return ""
+
+
+def pdf_page_count(pdf_path):
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def extract_file_part(file_path, start=None, end=None):
+    """
+    Process-pool task: extracts a .txt file, or pages [start, end) of a PDF.
+    Returns ([(page_no, text), ...], seconds spent, error); text files have page_no None.
+    error is None on a clean read, otherwise a message and no pages are returned.
+    """
+    started = time.perf_counter()
+    try:
+        if file_path.endswith(".pdf"):
+            pages = list(iter_pdf_pages(file_path, start or 0, end))
+        else:
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                pages = [(None, f.read())]
+    except Exception as e:
+        return [], time.perf_counter() - started, f"{type(e).__name__}: {e}"
+    return pages, time.perf_counter() - started, None
+
+
+def file_sha256(path, block_size=1 << 20):
+    """
+    Returns the hex SHA-256 digest of a file, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_npy_atomic(path, array):
+    """
+    Writes an .npy file via a temporary file and rename, so arrays that are
+    currently memory-mapped from the same path are never truncated under a reader.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
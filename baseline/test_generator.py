@@ -0,0 +1,218 @@
+import io
+import re
+import sys
+import threading
+import unittest
+import numpy as np
+from generator.generator import Generator, PROMPT_TOKEN_BUDGET, suppress_stdout_stderr
+
+
+class WordLlama:
+    """Stands in for llama_cpp.Llama: one token per word, BOS = 1."""
+
+    def __init__(self):
+        self.tokenize_calls = 0
+
+    def tokenize(self, text, add_bos=True):
+        self.tokenize_calls += 1
+        return ([1] if add_bos else []) + [len(word) for word in text.decode("utf-8").split()]
+
+
+class SpmLlama:
+    """
+    Tokenizes like llama.cpp's SPM vocab: a space is prepended to every call, spaces
+    attach to the following word and newlines are tokens of their own.
+    """
+
+    PIECE = re.compile(r"\n| ?[^\s]+| ")
+
+    def __init__(self):
+        self.vocab = {}
+
+    def tokenize(self, text, add_bos=True):
+        text = text.decode("utf-8")
+        if text:
+            text = " " + text
+        ids = [self.vocab.setdefault(piece, len(self.vocab) + 2) for piece in self.PIECE.findall(text)]
+        return ([1] if add_bos else []) + ids
+
+
+class EvalLlama(SpmLlama):
+    """SpmLlama that also keeps evaluated tokens and saves/loads them as its state."""
+
+    class State:
+        def __init__(self, input_ids):
+            self.input_ids = np.array(input_ids)
+
+    def __init__(self):
+        super().__init__()
+        self.input_ids = np.zeros(0, dtype=int)
+        self.n_tokens = 0
+        self.evaluated = 0
+
+    def eval(self, tokens):
+        self.input_ids = np.concatenate([self.input_ids[:self.n_tokens], tokens]).astype(int)
+        self.n_tokens += len(tokens)
+        self.evaluated += len(tokens)
+
+    def save_state(self):
+        return self.State(self.input_ids[:self.n_tokens])
+
+    def load_state(self, state):
+        self.input_ids = state.input_ids.copy()
+        self.n_tokens = len(state.input_ids)
+
+
+class DictPromptCache(dict):
+    """PromptCache without llama_cpp: returns the saved state sharing the longest prefix."""
+
+    min_prefix = 0
+
+    def __getitem__(self, key):
+        prefixes = [saved for saved in self if list(key[:len(saved)]) == list(saved)]
+        if not prefixes:
+            raise KeyError(key)
+        return dict.__getitem__(self, max(prefixes, key=len))
+
+    def __setitem__(self, key, state):
+        dict.__setitem__(self, tuple(key), state)
+
+
+class WordT5:
+    """Stands in for the flan-t5 pipeline: one token per word, summaries are the first 5 words."""
+
+    class Tokenizer:
+        def __call__(self, texts, add_special_tokens=True):
+            return {"input_ids": [text.split() for text in texts]}
+
+    def __init__(self):
+        self.tokenizer = self.Tokenizer()
+        self.calls = []
+
+    def __call__(self, prompts, batch_size=1, max_length=256, truncation=True):
+        self.calls.append(len(prompts))
+        return [{"generated_text": " ".join(prompt.split()[1:6])} for prompt in prompts]
+
+
+class TestGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = Generator()
+        self.llm = WordLlama()
+        self.generator._models["llm"] = self.llm
+
+    def test_pack_context_keeps_rank_order_within_budget(self):
+        chunks = ["one two three", "four five six seven eight", "nine ten"]
+        kept, tokens = self.generator.pack_context(chunks, budget=6)
+        # The second chunk does not fit, the third still does
+        self.assertEqual(kept, ["one two three", "nine ten"])
+        self.assertLessEqual(len(tokens), 6)
+
+    def test_build_prompt_keeps_question_and_caches_tokens(self):
+        question = "What is the capital of France?"
+        chunks = ["word " * 300, "Paris is the capital of France.", "word " * 300]
+        prompt = self.generator.build_prompt(chunks, question, "qa")
+        self.assertIn("### Instruction:", prompt)
+        self.assertIn(question, prompt)
+        self.assertIn("Paris is the capital of France.", prompt)
+
+        calls = self.llm.tokenize_calls
+        tokens = self.generator.prompt_tokens(prompt, "qa")
+        self.assertEqual(self.llm.tokenize_calls, calls)
+        self.assertEqual(tokens[0], 1)
+        self.assertLessEqual(len(tokens), PROMPT_TOKEN_BUDGET["qa"])
+
+        # Only the new question is tokenized; chunks and the instruction come from the cache
+        self.generator.build_prompt(chunks, "Another question?", "qa")
+        self.assertEqual(self.llm.tokenize_calls, calls + 1)
+
+    def test_packed_tokens_match_tokenizing_the_whole_prompt(self):
+        llm = SpmLlama()
+        self.generator._models["llm"] = llm
+        chunks = ["Paris is the capital of France.", "It lies on the Seine.", "word " * 600]
+        for task_type, question in (("qa", "What is the capital of France?"),
+                                    ("mcq", "Capital of France? a. Paris b. Rome c. Oslo d. Bern")):
+            prompt = self.generator.build_prompt(chunks, question, task_type)
+            self.assertIn("It lies on the Seine.", prompt)
+            self.assertEqual(self.generator.prompt_tokens(prompt, task_type),
+                             llm.tokenize(prompt.encode("utf-8"), add_bos=True))
+
+    def test_map_reduce_summary_batches_chunk_groups(self):
+        t5 = WordT5()
+        self.generator._models["t5"] = t5
+        chunks = [f"chunk{i} " * 300 for i in range(5)]
+        summary = self.generator.summarize_chunks(chunks, "summarize the chunks")
+        # Each 300-word chunk fills its own group: one batched map call, then the final summary
+        self.assertEqual(t5.calls, [5, 1])
+        self.assertEqual([stats["stage"] for stats in self.generator.last_summary_stats], ["map", "final"])
+        self.assertTrue(summary.startswith("chunk0"))
+
+    def test_map_reduce_summary_of_no_chunks_is_empty(self):
+        t5 = WordT5()
+        self.generator._models["t5"] = t5
+        self.assertEqual(self.generator.summarize_chunks([], "summarize nothing"), "")
+        self.assertEqual(self.generator.summarize_chunks(["  "], "summarize nothing"), "")
+        self.assertEqual(t5.calls, [])
+
+    def test_answer_mcq_normalises_over_option_letters(self):
+        llm = EvalLlama()
+        self.generator._models["llm"] = llm
+        prompt = self.generator.build_prompt(["Paris is the capital of France."],
+                                             "Capital of France? a. Rome b. Oslo c. Paris d. Bern", "mcq")
+        logits = np.zeros(len(llm.vocab) + 10)
+        letter_ids = self.generator._option_token_ids()
+        for letter, value in zip("ABCD", (1.0, -2.0, 4.0, 0.5)):
+            logits[letter_ids[letter]] = value
+        self.generator._last_logits = lambda: logits
+
+        answer, probabilities = self.generator.answer_mcq(prompt)
+        self.assertEqual(answer, "C")
+        self.assertAlmostEqual(sum(probabilities.values()), 1.0)
+        self.assertEqual(max(probabilities, key=probabilities.get), "C")
+        self.assertGreater(probabilities["A"], probabilities["D"])
+
+    def test_answer_mcq_caches_only_the_context_prefix(self):
+        llm = EvalLlama()
+        self.generator._models["llm"] = llm
+        self.generator.prompt_cache = DictPromptCache()
+        self.generator._last_logits = lambda: np.zeros(len(llm.vocab) + 10)
+        chunks = ["Paris is the capital of France.", "It lies on the Seine."]
+        first = self.generator.build_prompt(chunks, "Capital of France? a. Rome b. Oslo c. Paris d. Bern", "mcq")
+        second = self.generator.build_prompt(chunks, "River of Paris? a. Seine b. Rhine c. Po d. Elbe", "mcq")
+
+        self.generator.answer_mcq(first)
+        self.generator.answer_mcq(second)
+        # One saved state: instruction and context, without either question
+        self.assertEqual(len(self.generator.prompt_cache), 1)
+        context = self.generator.prompt_tokens(first[:first.rfind("\n\nQuestion:")], "mcq")
+        self.assertEqual(list(self.generator.prompt_cache), [tuple(context)])
+        # The second question only evaluates its own tail
+        tail = len(self.generator.prompt_tokens(second, "mcq")) - len(context)
+        self.assertEqual(self.generator.last_generation["evaluated_tokens"], tail)
+
+    def test_silencing_a_loader_thread_keeps_main_thread_output(self):
+        stdout, out = sys.stdout, io.StringIO()
+        sys.stdout = out
+        try:
+            silenced, printed = threading.Event(), threading.Event()
+
+            def load():
+                with suppress_stdout_stderr():
+                    silenced.set()
+                    printed.wait()
+                    print("llama.cpp log")
+
+            thread = threading.Thread(target=load)
+            thread.start()
+            silenced.wait()
+            print("Prompt: ")
+            printed.set()
+            thread.join()
+            print("Top Retrieved Chunks")
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(out.getvalue(), "Prompt: \nTop Retrieved Chunks\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -46,5 +46,49 @@ class TestPipeline(unittest.TestCase):
                     f"Answer not grounded in context: {answer}"
                 )
 
+class TestDocIds(unittest.TestCase):
+
+    def test_files_sharing_a_doc_id_are_refused(self):
+        from pipeline import check_doc_ids
+        check_doc_ids(["notes.txt", "other.pdf"])
+        for clash in (["notes.txt", "notes.pdf"], ["a b.txt", "a_b.txt"]):
+            with self.assertRaises(ValueError):
+                check_doc_ids(clash)
+
+
+class RankedRetriever:
+    """Stands in for Retriever: hybrid_query_batch returns fixed chunk-id rankings per query."""
+
+    rrf_k = 60
+
+    def __init__(self, rankings):
+        self.rankings = rankings
+        self.queries = None
+
+    def hybrid_query_batch(self, queries, k=5):
+        self.queries = queries
+        return [[{"chunk_id": chunk_id, "text": chunk_id} for chunk_id in ranking[:k]] for ranking in self.rankings]
+
+
+class TestMcqContext(unittest.TestCase):
+
+    def test_each_option_best_chunk_comes_first(self):
+        from pipeline import retrieve_mcq_context
+        retriever = RankedRetriever([
+            ["c1", "c2", "c3"],  # question
+            ["c1", "c4"],        # question + option A
+            ["c1", "c5"],        # B: c1 is already A's evidence, so c5
+            ["c6"],              # C
+            ["c2"],              # D
+        ])
+        chunks = retrieve_mcq_context(retriever, "Which one? a. red b. green c. blue d. black", k=10)
+        self.assertEqual(retriever.queries, ["Which one?", "Which one? Red", "Which one? Green",
+                                             "Which one? Blue", "Which one? Black"])
+        # Per-option picks in option order, then the rest by summed reciprocal-rank evidence
+        self.assertEqual([chunk["chunk_id"] for chunk in chunks], ["c1", "c5", "c6", "c2", "c4", "c3"])
+        self.assertAlmostEqual(chunks[0]["distance"], 3 / 61)
+        self.assertAlmostEqual(chunks[-1]["distance"], 1 / 63)
+
+
 if __name__ == "__main__":
     unittest.main()
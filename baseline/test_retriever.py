@@ -2,7 +2,19 @@
 import unittest
 import os
 import shutil
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from rank_bm25 import BM25Okapi
 from retriever.retriever import Retriever
+from retriever.bm25_index import BM25Index
+from retriever.fusion import fuse
+from retriever.faiss_index import recall_latency_report, build_faiss_index, set_search_params
+from retriever.extraction_cache import ExtractionCache
+from retriever.embedding_cache import QueryEmbeddingCache
+from retriever.utils import extract_file_part, ExtractionError
+from retriever.chunker import iter_chunks
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,8 +35,12 @@ class TestRetriever(unittest.TestCase):
         print(" Query relevance test passed.")
 
     def test_chunking(self):
-        chunks = self.retriever._chunk_text("A" * 1200)
-        self.assertEqual(len(chunks), 3)
+        text = "The prince left his planet. He met a fox in the desert. The fox asked to be tamed. " * 10
+        chunks = list(iter_chunks(text, self.retriever.count_tokens, max_tokens=40, overlap_tokens=10))
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(self.retriever.count_tokens(chunk), 40)
+            self.assertTrue(chunk.endswith("."))
         print(" Chunking test passed.")
 
     def test_saving_and_loading(self):
@@ -40,6 +56,234 @@ class TestRetriever(unittest.TestCase):
         self.assertTrue(result[0]["chunk_id"].startswith("doc1_chunk_"))
         print(" Save/load test passed.")
 
+    def test_load_memory_maps_embeddings(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.retriever.save(tmp)
+            new_retriever = Retriever()
+            new_retriever.load(tmp)
+            self.assertEqual(new_retriever.embeddings.shape, self.retriever.embeddings.shape)
+            self.assertEqual(new_retriever.embeddings.dtype, np.float32)
+            # Release the memory map so the directory can be removed on Windows too
+            del new_retriever
+        print(" Embedding persistence test passed.")
+
+    def test_upsert_and_delete_documents(self):
+        self.retriever.upsert_documents([
+            {"id": "doc3", "text": "Dragons fly over the misty mountains and breathe fire on the villages below."}
+        ])
+        result = self.retriever.hybrid_query("dragon breathing fire", k=1)
+        self.assertTrue(result[0]["chunk_id"].startswith("doc3"))
+
+        self.retriever.delete_documents(["doc3"])
+        result = self.retriever.hybrid_query("dragon breathing fire", k=3)
+        self.assertFalse(any(r["chunk_id"].startswith("doc3") for r in result))
+        print(" Incremental indexing test passed.")
+
+    def test_hnsw_deleted_vectors_do_not_take_result_slots(self):
+        retriever = Retriever(index_spec="HNSW8", compact_threshold=0.9)
+        retriever.add_documents([{"id": f"doc{i}", "text": f"Story number {i} is about a fox and a prince."}
+                                 for i in range(8)])
+        retriever.delete_documents(["doc0", "doc1", "doc2"])
+        self.assertEqual(retriever.dead_vectors, 3)
+        for k in (3, 5):
+            self.assertEqual(len(retriever.query_faiss("fox and prince", k=k)), k)
+
+        # Past the threshold the index is rebuilt without the deleted rows
+        retriever.compact_threshold = 0.25
+        retriever.delete_documents(["doc3"])
+        self.assertEqual(retriever.dead_vectors, 0)
+        self.assertEqual(retriever.index.ntotal, 4)
+        self.assertEqual(len(retriever.query_faiss("fox and prince", k=5)), 4)
+
+    def test_ivf_upsert_and_delete_keep_ids_aligned(self):
+        retriever = Retriever(index_spec="IVF2,Flat", nprobe=2)
+        retriever.add_documents([{"id": f"doc{i}", "text": f"Story number {i} is about a prince" + " fox" * i}
+                                 for i in range(8)])
+        retriever.upsert_documents([{"id": "doc1", "text": "A new story about a fox in the snow."}])
+        retriever.delete_documents(["doc2", "doc3"])
+        self.assertEqual(retriever.dead_vectors, 0)
+        with tempfile.TemporaryDirectory() as tmp:
+            retriever.save(tmp)
+            loaded = Retriever()
+            loaded.load(tmp)
+            query = loaded._encode_queries(["fox"])
+            distances, indices = loaded._search_faiss(["fox"], 3)
+            # Every hit is a live row and its distance is the distance to that row's vector
+            for distance, row in zip(distances[0], indices[0]):
+                self.assertIsNotNone(loaded.documents[row])
+                self.assertAlmostEqual(distance, float(np.sum((loaded.embeddings[row] - query[0]) ** 2)), places=3)
+            del loaded
+
+
+
+class TestBM25Index(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = [
+            "the little prince travels from planet to planet".split(),
+            "sherlock holmes solves mysteries with logic".split(),
+            "the prince and the fox talk about the rose".split(),
+        ]
+        self.index = BM25Index.build(self.corpus)
+
+    def test_scores_match_rank_bm25(self):
+        query = ["prince", "planet", "unknown"]
+        expected = BM25Okapi(self.corpus).get_scores(query)
+        doc_ids, scores = self.index.get_scores(query)
+        dense = np.zeros(len(self.corpus))
+        dense[doc_ids] = scores
+        np.testing.assert_allclose(dense, expected, rtol=1e-5)
+
+    def test_top_k_matches_full_ranking(self):
+        query = ["the", "prince", "logic"]
+        expected = BM25Okapi(self.corpus).get_scores(query)
+        doc_ids, scores = self.index.top_k(query, k=2)
+        self.assertEqual(list(doc_ids), list(np.argsort(expected)[::-1][:2]))
+        np.testing.assert_allclose(scores, np.sort(expected)[::-1][:2], rtol=1e-5)
+
+    def test_top_k_batch_matches_single_queries(self):
+        queries = [["prince", "rose"], ["logic"], ["missing"]]
+        for query, (doc_ids, scores) in zip(queries, self.index.top_k_batch(queries, k=2)):
+            expected_ids, expected_scores = self.index.top_k(query, k=2)
+            self.assertEqual(list(doc_ids), list(expected_ids))
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_top_k_batch_first_calls_from_many_threads(self):
+        queries = [["prince", "rose"], ["logic"]]
+        expected = BM25Index.build(self.corpus).top_k_batch(queries, k=2)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(lambda _: self.index.top_k_batch(queries, k=2), range(32)))
+        for result in results:
+            for (doc_ids, scores), (expected_ids, expected_scores) in zip(result, expected):
+                self.assertEqual(list(doc_ids), list(expected_ids))
+                np.testing.assert_allclose(scores, expected_scores)
+
+    def test_top_k_exact_with_negative_idf(self):
+        # Small, skewed corpora push the epsilon-floored idf below zero, which MaxScore cannot prune
+        rng = np.random.default_rng(1)
+        for _ in range(200):
+            vocab = [f"w{i}" for i in range(rng.integers(2, 8))]
+            p = rng.dirichlet(np.full(len(vocab), 0.3))
+            corpus = [list(rng.choice(vocab, rng.integers(1, 8), p=p)) for _ in range(rng.integers(2, 10))]
+            index = BM25Index.build(corpus)
+            queries = [list(rng.choice(vocab, rng.integers(1, 4))) for _ in range(3)]
+            for query, (_, batch_scores) in zip(queries, index.top_k_batch(queries, k=3)):
+                _, all_scores = index.get_scores(query)
+                expected = np.sort(all_scores)[::-1][:3]
+                np.testing.assert_allclose(index.top_k(query, k=3)[1], expected, rtol=1e-5, atol=1e-6)
+                np.testing.assert_allclose(batch_scores, expected, rtol=1e-5, atol=1e-6)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.index.save(tmp)
+            loaded = BM25Index.load(tmp)
+            np.testing.assert_allclose(loaded.get_scores(["fox"])[1], self.index.get_scores(["fox"])[1])
+            del loaded
+
+
+class TestFaissIndex(unittest.TestCase):
+
+    def test_recall_latency_report_on_ivf(self):
+        vectors = np.random.default_rng(0).standard_normal((500, 16)).astype('float32')
+        rows = recall_latency_report(vectors, "IVF16,Flat", k=5, num_queries=50, nprobe_values=(1, 16))
+        self.assertEqual([row["params"] for row in rows], [{}, {"nprobe": 1}, {"nprobe": 16}])
+        # Probing every list is exact search
+        self.assertAlmostEqual(rows[-1]["recall"], 1.0)
+
+    def test_ivf_remove_ids_keeps_ids_aligned(self):
+        vectors = np.random.default_rng(0).standard_normal((400, 16)).astype('float32')
+        for spec in ("IVF4,Flat", "Flat"):
+            index = build_faiss_index(vectors, spec)
+            set_search_params(index, {"nprobe": 4})
+            index.remove_ids(np.arange(100, dtype='int64'))
+            _, ids = index.search(vectors[100:110], 5)
+            np.testing.assert_array_equal(ids[:, 0], np.arange(100, 110))
+            self.assertTrue(np.all(ids >= 100))
+
+
+class TestExtractionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ExtractionCache(os.path.join(self.tmp.name, "cache"))
+        self.path = os.path.join(self.tmp.name, "doc.txt")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("some text")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_clean_read_is_committed(self):
+        pages = list(self.cache.store(self.path, iter([(None, "Hello   world")])))
+        self.assertEqual(pages, [(None, "Hello world")])
+        self.assertTrue(self.cache.contains(self.path))
+        self.assertEqual(list(self.cache.read(self.path)), [(None, "Hello world")])
+
+    def test_failed_read_is_not_committed(self):
+        def pages():
+            yield 1, "first page"
+            raise ExtractionError("Error reading doc.txt")
+
+        with self.assertRaises(ExtractionError):
+            list(self.cache.store(self.path, pages()))
+        self.assertFalse(self.cache.contains(self.path))
+        self.assertEqual(os.listdir(self.cache.cache_dir), [ExtractionCache.INDEX_FILE])
+
+    def test_corrupt_pdf_reports_an_error(self):
+        bad_pdf = os.path.join(self.tmp.name, "bad.pdf")
+        with open(bad_pdf, "wb") as f:
+            f.write(b"%PDF-1.4 not really a pdf")
+        pages, _, error = extract_file_part(bad_pdf, 0, None)
+        self.assertEqual(pages, [])
+        self.assertIsNotNone(error)
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = QueryEmbeddingCache(maxsize=2)
+        cache.put("a", np.ones(3))
+        cache.put("b", np.ones(3))
+        cache.get("a")
+        cache.put("c", np.ones(3))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_ttl_expiry(self):
+        cache = QueryEmbeddingCache(ttl=60)
+        cache.put("old", np.ones(3))
+        vector, _ = cache._entries["old"]
+        cache._entries["old"] = (vector, time.time() - 120)
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(len(cache), 0)
+
+    def test_save_and_load_round_trip(self):
+        cache = QueryEmbeddingCache(model="minilm:torch")
+        cache.put("What is a Fox?", np.arange(3, dtype=np.float32))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "query_cache.npz")
+            cache.save(path)
+            loaded = QueryEmbeddingCache(model="minilm:torch")
+            loaded.load(path)
+            np.testing.assert_array_equal(loaded.get("what is a  fox?"), np.arange(3))
+            # Vectors from another embedding backend are not served
+            other = QueryEmbeddingCache(model="minilm:onnx-int8")
+            other.load(path)
+            self.assertEqual(len(other), 0)
+
+
+class TestFusion(unittest.TestCase):
+
+    def test_rrf_dedupes_by_chunk_index(self):
+        ids, scores = fuse([3, 1, 2], [9.0, 5.0, 1.0], [1, 7, -1], [0.1, 0.5, 0.0], k=3, method="rrf")
+        self.assertEqual(list(ids), [1, 3, 7])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_alpha_one_keeps_bm25_order(self):
+        ids, _ = fuse([3, 1, 2], [9.0, 5.0, 1.0], [2, 7], [0.1, 0.5], k=3, method="minmax", alpha=1.0)
+        self.assertEqual(list(ids), [3, 1, 2])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=0)
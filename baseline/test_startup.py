@@ -0,0 +1,46 @@
+# test_startup.py
+import os
+import sys
+import subprocess
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Budget for `import pipeline` in milliseconds; override with IMPORT_BUDGET_MS
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 1500))
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers", "llama_cpp",
+                 "faiss", "nltk", "fitz", "scipy", "evaluate"]
+
+
+def import_time_ms(module):
+    """Cumulative import time of a module in a fresh interpreter, from `python -X importtime`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BASE_DIR, capture_output=True, text=True, check=True,
+    )
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"{module} not found in -X importtime output")
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_pipeline_import_skips_heavy_modules(self):
+        code = (
+            "import sys, pipeline; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        )
+        proc = subprocess.run([sys.executable, "-c", code], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True)
+        self.assertEqual(proc.stdout.strip(), "", f"Imported at startup: {proc.stdout.strip()}")
+
+    def test_pipeline_import_time_budget(self):
+        elapsed = import_time_ms("pipeline")
+        print(f" import pipeline: {elapsed:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+        self.assertLessEqual(elapsed, IMPORT_BUDGET_MS)
+
+
+if __name__ == "__main__":
+    unittest.main()
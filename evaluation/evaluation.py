@@ -1,18 +1,25 @@
 import json
 import argparse
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import evaluate
 from nltk.tokenize import WordPunctTokenizer
 
 # Use WordPunctTokenizer to avoid issues with punkt_tab
 tokenizer = WordPunctTokenizer()
 
-# Load evaluation metrics
-bertscore = evaluate.load("bertscore")
+# Evaluation metrics are loaded on first use, not at import time
+_bertscore = None
+
+def get_bertscore():
+    global _bertscore
+    if _bertscore is None:
+        # Aliased because this module defines its own evaluate() function
+        import evaluate as hf_evaluate
+        _bertscore = hf_evaluate.load("bertscore")
+    return _bertscore
 
 def compute_cosine_similarity(references, generated):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
     vectorizer = TfidfVectorizer()
     all_texts = references + generated
     tfidf = vectorizer.fit_transform(all_texts)
@@ -22,7 +29,7 @@ def compute_cosine_similarity(references, generated):
     return [cosine_similarities[i, i] for i in range(len(references))]
 
 def compute_bertscore(references, generated):
-    results = bertscore.compute(predictions=generated, references=references, lang="en")
+    results = get_bertscore().compute(predictions=generated, references=references, lang="en")
     return results["f1"]
 
 def compute_word_overlap(references, generated):